@@ -11,6 +11,7 @@ const char *WIFI_SSID = "SSID"; // SSID
 const char *WIFI_PASS = "PASSWORD"; // PASSWORD
 
 WebServer server(80); // Initiate web server
+WebServer streamServer(81); // MJPEG server, served by its own task
 
 // Define resolutions sizes
 static auto loRes = esp32cam::Resolution::find(320, 240);
@@ -36,6 +37,21 @@ void serveJpg()
   frame->writeTo(client);
 }
 
+// Stream func, sends multipart/x-mixed-replace frames until the client leaves
+void serveMjpeg(const esp32cam::Resolution &res)
+{
+  if (!esp32cam::Camera.changeResolution(res))
+  {
+    Serial.println("SET-STREAM-RES FAIL");
+  }
+  Serial.println("STREAM BEGIN");
+  WiFiClient client = streamServer.client();
+  auto startTime = millis();
+  int nFrames = esp32cam::Camera.streamMjpeg(client);
+  auto duration = millis() - startTime;
+  Serial.printf("STREAM END %dfrm %0.2ffps\n", nFrames, 1000.0 * nFrames / duration);
+}
+
 // LED func
 void serveLED(int duty)
 {
@@ -62,6 +78,16 @@ void ledOff(){
   serveLED(0);
 }
 
+// LED duty handler, /led?duty=0..255
+void ledDuty(){
+  if (!server.hasArg("duty"))
+  {
+    server.send(400, "text/plain", "DUTY MISSING");
+    return;
+  }
+  serveLED(constrain(server.arg("duty").toInt(), 0, 255));
+}
+
 // Electromagnet ON handler
 void electroOn(){
   digitalWrite(RELAY, HIGH);
@@ -104,6 +130,35 @@ void handleJpgMid()
   serveJpg();
 }
 
+// LOW RES stream handler
+void handleMjpegLo()
+{
+  serveMjpeg(loRes);
+}
+
+// MEDIUM RES stream handler
+void handleMjpegMid()
+{
+  serveMjpeg(midRes);
+}
+
+// HIGH RES stream handler
+void handleMjpegHi()
+{
+  serveMjpeg(hiRes);
+}
+
+// Stream task. A stream never returns while the client is connected,
+// so it runs beside loop() to keep the LED and electromagnet routes alive
+void streamTask(void *)
+{
+  while (true)
+  {
+    streamServer.handleClient();
+    delay(1);
+  }
+}
+
 // Setup. Called once
 void setup()
 {
@@ -138,10 +193,17 @@ void setup()
   server.on("/mid.jpg", handleJpgMid);
   server.on("/led/on", ledOn);
   server.on("/led/off", ledOff);
+  server.on("/led", ledDuty);
   server.on("/electro/on", electroOn);
   server.on("/electro/off", electroOff);
   server.begin();
 
+  streamServer.on("/lo.mjpeg", handleMjpegLo);
+  streamServer.on("/mid.mjpeg", handleMjpegMid);
+  streamServer.on("/hi.mjpeg", handleMjpegHi);
+  streamServer.begin();
+  xTaskCreatePinnedToCore(streamTask, "stream", 8192, nullptr, 1, nullptr, 0);
+
   // Print URLs
   Serial.print("http://");
   Serial.println(WiFi.localIP());
@@ -150,8 +212,12 @@ void setup()
   Serial.println("  /mid.jpg");
   Serial.println("  /led/on");
   Serial.println("  /led/off");
+  Serial.println("  /led?duty=0..255");
   Serial.println("  /electro/on");
   Serial.println("  /electro/off");
+  Serial.println("  :81/lo.mjpeg");
+  Serial.println("  :81/mid.mjpeg");
+  Serial.println("  :81/hi.mjpeg");
 }
 
 // Await connections
@@ -0,0 +1,115 @@
+import time
+import cv2
+
+from ArucoProcess import ArucoProcess
+from WebRequester import WebRequester, QUALITIES, sizePicker
+from Calibration import intrinsicsFor
+
+
+class AdaptiveQuality:
+    def __init__(
+        self,
+        requester: WebRequester,
+        processor: ArucoProcess,
+        minSide: float = 24,
+        margin: float = 1.6,
+        minFps: float = 8,
+        hold: int = 10,
+    ) -> None:
+        """Pick lo/mid/hi per frame from the ArUco size in pixels and the loop rate
+
+        The followed ArUco is the small one when visible, else the big one. The
+        quality steps up when it has fewer than minSide pixels per side, and
+        steps down when the lower quality would still give it margin * minSide.
+        Below minFps, the margin is dropped to step down sooner and the quality
+        only steps up to save a marker about to be lost.
+
+        Args:
+            requester (WebRequester): Requester whose quality is driven
+            processor (ArucoProcess): Processor following the frame size and intrinsics
+            minSide (float, optional): Fewest pixels per ArUco side for a reliable detection. Defaults to 24.
+            margin (float, optional): Hysteresis factor on minSide to step down. Defaults to 1.6.
+            minFps (float, optional): Loop rate under which lower qualities are preferred. Defaults to 8.
+            hold (int, optional): Frames to wait between two switches. Defaults to 10.
+        """
+        self.requester = requester
+        self.processor = processor
+        self.minSide = minSide
+        self.margin = margin
+        self.minFps = minFps
+        self.hold = hold
+        self.fps = 0.0
+        self._last = None
+        self._since = 0
+        self._lost = 0
+        self._cameraQuality = None
+
+    def prepare(self, quality: str = None) -> None:
+        """Give the processor the size and intrinsics of the frame about to be processed
+
+        Call it before processor.getArucos(), with the quality returned by
+        requester.latest(): the capture thread may already hold a newer frame.
+
+        Args:
+            quality (str, optional): Quality of the frame. Defaults to requester.frameQuality, set by requester.request().
+        """
+        quality = quality or self.requester.frameQuality
+        if quality == self._cameraQuality:
+            return
+        camera = intrinsicsFor(quality)
+        self.processor.setCamera(camera.matrix, camera.distortion, *camera.size)
+        self._cameraQuality = quality
+
+    def side(self) -> float:
+        """Side of the followed ArUco in the last processed frame
+
+        Returns:
+            float: Mean side length in pixels, 0 if no ArUco is visible
+        """
+        processor = self.processor
+        corners = processor.corners.get(processor.id2, processor.corners.get(processor.id1))
+        if corners is None:
+            return 0.0
+        return cv2.arcLength(corners, True) / 4
+
+    def update(self) -> str:
+        """Choose the quality of the next frames, call it once per loop after processor.getArucos()
+
+        Returns:
+            str: Quality requested from now on
+        """
+        now = time.monotonic()
+        if self._last is not None and now > self._last:
+            rate = 1 / (now - self._last)
+            self.fps = rate if self.fps == 0 else 0.8 * self.fps + 0.2 * rate
+        self._last = now
+        self._since += 1
+
+        quality = self.requester.quality
+        level = QUALITIES.index(quality)
+        side = self.side()
+        # Sides scale with the frame width, the field of view is the same
+        side *= sizePicker(quality)[0] / self.processor.width
+        self._lost = 0 if side > 0 else self._lost + 1
+
+        slow = self.fps and self.fps < self.minFps
+        wanted = level
+        if side == 0:
+            if self._lost > self.hold:
+                wanted = level + 1
+        elif side < self.minSide:
+            wanted = level + 1
+        elif level > 0:
+            lower = side * sizePicker(QUALITIES[level - 1])[0] / sizePicker(quality)[0]
+            if lower >= self.minSide * (1 if slow else self.margin):
+                wanted = level - 1
+        if slow and wanted > level and side >= self.minSide / 2:
+            # Still detected, keep the loop rate
+            wanted = level
+        wanted = min(max(wanted, 0), len(QUALITIES) - 1)
+
+        if wanted != level and self._since >= self.hold:
+            self.requester.setQuality(QUALITIES[wanted])
+            self._since = 0
+            self._lost = 0
+        return self.requester.quality
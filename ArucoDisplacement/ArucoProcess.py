@@ -4,6 +4,107 @@ from cv2 import aruco
 import numpy as np
 import math
 
+from Metrics import METRICS
+
+# 180 deg rotation matrix around the x axis
+R_FLIP = np.diag([1.0, -1.0, -1.0])
+
+# Stop criteria of the full resolution corner refinement, see ArucoProcess.setPyramid()
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_COUNT, 20, 0.05)
+
+# aruco.DetectorParameters overrides by profile name, see ArucoProcess.setProfile()
+PROFILES = {
+    "default": {},
+    # Big marker far away: few threshold passes, no corner refinement
+    "fast-approach": {
+        "adaptiveThreshWinSizeMin": 7,
+        "adaptiveThreshWinSizeMax": 17,
+        "adaptiveThreshWinSizeStep": 10,
+        "polygonalApproxAccuracyRate": 0.05,
+        "cornerRefinementMethod": aruco.CORNER_REFINE_NONE,
+    },
+    # Small marker close up: every pass and sub-pixel corners for the pose
+    "precise-dock": {
+        "adaptiveThreshWinSizeMin": 3,
+        "adaptiveThreshWinSizeMax": 33,
+        "adaptiveThreshWinSizeStep": 10,
+        "minMarkerPerimeterRate": 0.05,
+        "cornerRefinementMethod": aruco.CORNER_REFINE_SUBPIX,
+        "cornerRefinementWinSize": 5,
+    },
+}
+
+
+def detectorParameters(profile: _typing.Union[str, dict]) -> aruco.DetectorParameters:
+    """Build detector parameters from a profile
+
+    Args:
+        profile (str | dict): Name in PROFILES, or attribute overrides. e.g: {"adaptiveThreshWinSizeStep": 20}
+
+    Raises:
+        KeyError: unknown profile name
+        AttributeError: unknown DetectorParameters attribute
+
+    Returns:
+        aruco.DetectorParameters: OpenCV defaults with the profile applied
+    """
+    overrides = PROFILES[profile] if isinstance(profile, str) else profile
+    params = aruco.DetectorParameters()
+    for name, value in overrides.items():
+        if not hasattr(params, name):
+            raise AttributeError(f"DetectorParameters has no {name}")
+        setattr(params, name, value)
+    return params
+
+
+class ArucoData(_typing.NamedTuple):
+    """Entry of ArucoProcess.dico"""
+
+    cx: float  # Center offset from the frame center, in pixels (right positive)
+    cy: float  # Center offset from the frame center, in pixels (up positive)
+    rotZ: float  # Yaw of the marker in degrees
+    size: float  # Real size over perimeter ratio, in cm per pixel-side unit
+    tvec: np.ndarray = None  # Marker position in the camera frame, in cm
+    rvec: np.ndarray = None  # Marker rotation vector in the camera frame
+    rpy: tuple[float, float, float] = None  # Roll, pitch and yaw in degrees
+
+
+def markerPoints(size: float) -> np.ndarray:
+    """Corners of a square marker in its own frame, in the order expected by SOLVEPNP_IPPE_SQUARE
+
+    Args:
+        size (float): Side length
+
+    Returns:
+        np.ndarray: 4x3 object points, top left first and clockwise
+    """
+    half = size / 2
+    return np.array(
+        [[-half, half, 0], [half, half, 0], [half, -half, 0], [-half, -half, 0]],
+        dtype=np.float32,
+    )
+
+
+def planarPose(corners: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Image plane center, yaw and perimeter of markers, all at once
+
+    Args:
+        corners (np.ndarray): Nx4x2 corners, top left first and clockwise, in pixels
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Nx2 centers, N yaws in degrees (same sign as the PnP yaw) and N perimeters
+    """
+    corners = np.asarray(corners, dtype=np.float64)
+    edges = np.roll(corners, -1, axis=1) - corners
+    # Marker x axis: top and bottom edges, plus left and right edges turned by -90 deg
+    x = edges[:, 0] - edges[:, 2]
+    x[:, 0] += edges[:, 1, 1] - edges[:, 3, 1]
+    x[:, 1] -= edges[:, 1, 0] - edges[:, 3, 0]
+    # Image y points down, the yaw is counterclockwise on the ceiling
+    yaws = -np.degrees(np.arctan2(x[:, 1], x[:, 0]))
+    perimeters = np.hypot(edges[..., 0], edges[..., 1]).sum(axis=1)
+    return corners.mean(axis=1), yaws, perimeters
+
 
 class ArucoProcess:
 
@@ -18,6 +119,12 @@ class ArucoProcess:
         arucoSize2: float = 12.5,
         id1: int = 81,
         id2: int = 88,
+        tracking: bool = False,
+        targetOnly: bool = False,
+        profile: _typing.Union[str, dict] = "default",
+        pyramid: bool = False,
+        flow: bool = False,
+        pose: bool = True,
     ) -> None:
         """Init ArucoProcess class
 
@@ -31,6 +138,12 @@ class ArucoProcess:
             arucoSize2 (int, optional): Small ArUco real size in mm. Defaults to 12.5 (mm).
             id1 (int, optional): ID of the biggest searched ArUco. Defaults to 81.
             id2 (int, optional): ID of the smallest searched ArUco. Defaults to 88.
+            tracking (bool, optional): Search around the last known ArUcos first, see setTracking(). Defaults to False.
+            targetOnly (bool, optional): Match candidates against id1 and id2 only, see setTargetOnly(). Defaults to False.
+            profile (str | dict, optional): Detector parameters profile, see setProfile(). Defaults to "default".
+            pyramid (bool, optional): Detect large frames at a reduced scale first, see setPyramid(). Defaults to False.
+            flow (bool, optional): Follow the corners with optical flow between detections, see setFlow(). Defaults to False.
+            pose (bool, optional): Solve the 3D pose of every frame, see setPose(). Defaults to True.
         """
         self.matrix = matrix
         self.distortion = distortion
@@ -45,29 +158,390 @@ class ArucoProcess:
         )
         self.arucoSize1 = arucoSize1
         self.arucoSize2 = arucoSize2
-        self.arucoDict = aruco.getPredefinedDictionary(self.arucoType)
-        self.arucoParams = aruco.DetectorParameters()
         self.width = width
         self.height = height
         self.id1 = id1
         self.id2 = id2
+        self.setTargetOnly(targetOnly)
+        self.setProfile(profile)
+        # Object points in cm, solved once per marker and per frame
+        self.objectPoints = {
+            id1: markerPoints(arucoSize1 / 10),
+            id2: markerPoints(arucoSize2 / 10),
+        }
         self.frame: cv2.typing.MatLike = None
         self.dico = {}
+        self.corners = {}  # Corners of the searched ArUcos in dico, full resolution
         self.rotaZion = 0
+        # Detection of the last frame, reused while self.frame is the same object
+        self._detectedFrame: cv2.typing.MatLike = None
+        self._detected = None
+        self._scale = 1.0
+        self.setTracking(tracking)
+        self.setPyramid(pyramid)
+        self.setFlow(flow)
+        self.setPose(pose)
+
+        self.TL = (1, 1)
+        self.TR = (self.width - 1, 1)
+        self.BL = (1, self.height - 1)
+        self.BR = (self.width - 1, self.height - 1)
+
+    def setCamera(
+        self,
+        matrix: cv2.typing.MatLike,
+        distortion: cv2.typing.MatLike,
+        width: int,
+        height: int,
+    ) -> None:
+        """Follow a change of frame size, e.g. when the requester quality switches
 
-        # self.TL = (1, 1)
-        # self.TR = (self.width - 1, 1)
-        # self.BL = (1, self.height - 1)
-        # self.BR = (self.width - 1, self.height - 1)
+        Args:
+            matrix (cv2.typing.MatLike): Camera matrix for the new size
+            distortion (cv2.typing.MatLike): Camera distortion for the new size
+            width (int): New width of the frame in pixel
+            height (int): New height of the frame in pixel
+        """
+        if self._box is not None:
+            self._box = self._box * np.array(
+                [width / self.width, height / self.height] * 2
+            )
+            self._velocity = self._velocity * np.array(
+                [width / self.width, height / self.height]
+            )
+        self.matrix = matrix
+        self.distortion = distortion
+        self.width = width
+        self.height = height
+        self._detectedFrame = None
+        self.TR = (self.width - 1, 1)
+        self.BL = (1, self.height - 1)
+        self.BR = (self.width - 1, self.height - 1)
 
     def grayOut(self) -> cv2.typing.MatLike:
         """Return grayscale of the frame
 
         Returns:
-            Matlike: Grayscale of the frame
+            Matlike: Grayscale of the frame, the frame itself if already decoded in gray
         """
+        if self.frame.ndim == 2:
+            return self.frame
         return cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
 
+    def setProfile(self, profile: _typing.Union[str, dict]) -> None:
+        """Switch the detector parameters, applies from the next frame
+
+        The detection of the current frame stays cached, so switching between
+        getArucos() and showArucos() never detects the same frame twice.
+
+        Args:
+            profile (str | dict): Name in PROFILES, e.g. fast-approach or precise-dock, or attribute overrides
+        """
+        self.arucoParams = detectorParameters(profile)
+        self.profile = profile
+
+    def setTargetOnly(self, enabled: bool) -> None:
+        """Detect with a dictionary holding only the id1 and id2 codes
+
+        Candidates are compared with 2 codes instead of 1000 and other ArUcos
+        of the dictionary on the ceiling are no longer reported. Detected ids
+        are mapped back to id1 and id2.
+
+        Args:
+            enabled (bool): Use the reduced dictionary, else the full predefined one
+        """
+        full = aruco.getPredefinedDictionary(self.arucoType)
+        self.targetOnly = enabled
+        if not enabled:
+            self.arucoDict = full
+            self._dictIds = None
+            return
+        self._dictIds = np.array([self.id1, self.id2], dtype=np.int32)
+        self.arucoDict = aruco.Dictionary(
+            full.bytesList[self._dictIds], full.markerSize, full.maxCorrectionBits
+        )
+        self._detectedFrame = None
+
+    def setTracking(
+        self,
+        enabled: bool,
+        refresh: int = 15,
+        padding: float = 0.5,
+        motion: float = 2.0,
+    ) -> None:
+        """Search the searched ArUcos in a crop around their last position
+
+        Args:
+            enabled (bool): Turn ROI tracking on or off
+            refresh (int, optional): Frames between forced full frame searches. Defaults to 15.
+            padding (float, optional): Margin around the last corners, in marker sizes. Defaults to 0.5.
+            motion (float, optional): Extra margin per pixel of motion since the previous frame. Defaults to 2.0.
+        """
+        self.tracking = enabled
+        self.refresh = refresh
+        self.padding = padding
+        self.motion = motion
+        self._box: np.ndarray = None  # x0, y0, x1, y1 of the last targets, full resolution
+        self._velocity = np.zeros(2)
+        self._sinceFull = 0
+
+    def setPyramid(
+        self,
+        enabled: bool,
+        minWidth: int = 1000,
+        factor: float = 0.5,
+        minSide: float = 12,
+        window: int = 5,
+    ) -> None:
+        """Detect large frames on a downscaled copy, then refine the corners on the full resolution
+
+        The corners found on the coarse level are moved to the full resolution
+        grayscale with cornerSubPix, which only reads a small window around
+        each of them, so the pose keeps the full resolution precision. The
+        full resolution is searched instead when no searched ArUco is found,
+        or when only the big one is and the small one would be too small to
+        be read at the coarse level.
+
+        Args:
+            enabled (bool): Turn the coarse to fine detection on or off
+            minWidth (int, optional): Narrowest grayscale frame, in pixels, detected coarse to fine. Defaults to 1000 (hi).
+            factor (float, optional): Scale of the coarse level. Defaults to 0.5.
+            minSide (float, optional): Smallest side in coarse pixels the small ArUco can be read at. Defaults to 12.
+            window (int, optional): Half side of the refinement windows, in full resolution pixels. Defaults to 5.
+        """
+        self.pyramid = enabled
+        self.pyramidMinWidth = minWidth
+        self.pyramidFactor = factor
+        self.pyramidMinSide = minSide
+        self.pyramidWindow = window
+        self._detectedFrame = None
+
+    def setFlow(
+        self,
+        enabled: bool,
+        every: int = 5,
+        maxError: float = 12.0,
+        window: int = 21,
+        levels: int = 3,
+    ) -> None:
+        """Follow the searched ArUcos corners with pyramidal Lucas-Kanade between full detections
+
+        A full detection runs every `every` frames, or as soon as a corner is
+        lost or its LK error goes over maxError; the frames in between move the
+        corners of the last detection. Only a crop around the corners, as wide
+        as LK can reach, is handed to LK, so its pyramids cost a fraction of
+        the frame.
+
+        Args:
+            enabled (bool): Turn the optical flow on or off
+            every (int, optional): Frames between full detections. Defaults to 5.
+            maxError (float, optional): Highest LK error of a corner, mean gray level difference of its window. Defaults to 12.0.
+            window (int, optional): LK window side in pixels. Defaults to 21.
+            levels (int, optional): LK pyramid levels above the frame. Defaults to 3.
+        """
+        self.flow = enabled
+        self.flowEvery = every
+        self.flowMaxError = maxError
+        self.flowWindow = window
+        self.flowLevels = levels
+        self._flowGray: cv2.typing.MatLike = None  # Grayscale the points were found on
+        self._flowPoints: np.ndarray = None  # Nx1x2 corners of the searched ArUcos, grayscale pixels
+        self._flowIds: np.ndarray = None
+        self._sinceDetect = 0
+        self._detectedFrame = None
+
+    def _flowTrack(
+        self, gray: cv2.typing.MatLike
+    ) -> tuple[_typing.Sequence[cv2.typing.MatLike], cv2.typing.MatLike]:
+        previous = self._flowGray
+        if (
+            self._flowPoints is None
+            or self._sinceDetect >= self.flowEvery
+            or previous.shape != gray.shape
+        ):
+            return None
+        # Farthest a point moves through the pyramid
+        reach = self.flowWindow * 2**self.flowLevels // 2
+        h, w = gray.shape[:2]
+        x0, y0 = np.maximum(self._flowPoints.min(axis=(0, 1)) - reach, 0).astype(int)
+        x1, y1 = np.minimum(self._flowPoints.max(axis=(0, 1)) + reach + 1, (w, h)).astype(int)
+        offset = np.array([x0, y0], dtype=np.float32)
+        with METRICS.span("aruco.flow"):
+            points, status, error = cv2.calcOpticalFlowPyrLK(
+                previous[y0:y1, x0:x1],
+                gray[y0:y1, x0:x1],
+                self._flowPoints - offset,
+                None,
+                winSize=(self.flowWindow, self.flowWindow),
+                maxLevel=self.flowLevels,
+            )
+        if not status.all() or error.max() > self.flowMaxError:
+            METRICS.count("aruco.flow.lost")
+            return None
+        self._sinceDetect += 1
+        points += offset
+        corners = tuple(points[k : k + 4].reshape(1, 4, 2) for k in range(0, len(points), 4))
+        return corners, self._flowIds
+
+    def _flowKeep(
+        self,
+        gray: cv2.typing.MatLike,
+        corners: _typing.Sequence[cv2.typing.MatLike],
+        ids: cv2.typing.MatLike,
+    ) -> None:
+        self._flowGray = gray
+        targets = [
+            j for j in range(len(corners)) if ids[j][0] == self.id1 or ids[j][0] == self.id2
+        ] if ids is not None else []
+        if not targets:
+            self._flowPoints = None
+            return
+        self._flowIds = ids[targets]
+        self._flowPoints = np.concatenate(
+            [corners[j].reshape(4, 1, 2) for j in targets]
+        ).astype(np.float32)
+
+    def _roi(self, shape: tuple[int, int]) -> tuple[int, int, int, int]:
+        if not self.tracking or self._box is None or self._sinceFull >= self.refresh:
+            return None
+        # Scale of the searched image, the coarse level included
+        scale = self.width / shape[1]
+        x0, y0, x1, y1 = self._box / scale
+        margin = self.padding * max(x1 - x0, y1 - y0)
+        mx = margin + self.motion * abs(self._velocity[0]) / scale
+        my = margin + self.motion * abs(self._velocity[1]) / scale
+        h, w = shape[:2]
+        x0, x1 = max(0, int(x0 - mx)), min(w, int(x1 + mx) + 1)
+        y0, y1 = max(0, int(y0 - my)), min(h, int(y1 + my) + 1)
+        if (x1 - x0) * (y1 - y0) > 0.5 * w * h:
+            # Barely smaller than the frame, a full search costs the same
+            return None
+        return x0, y0, x1, y1
+
+    def _detectMarkers(
+        self, gray: cv2.typing.MatLike
+    ) -> tuple[_typing.Sequence[cv2.typing.MatLike], cv2.typing.MatLike]:
+        (corners, ids, _) = cv2.aruco.detectMarkers(
+            gray, self.arucoDict, parameters=self.arucoParams
+        )
+        if ids is not None and self._dictIds is not None:
+            # Index in the reduced dictionary back to the real ID
+            ids = self._dictIds[ids]
+        return corners, ids
+
+    def _search(
+        self, gray: cv2.typing.MatLike
+    ) -> tuple[_typing.Sequence[cv2.typing.MatLike], cv2.typing.MatLike]:
+        roi = self._roi(gray.shape)
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            corners, ids = self._detectMarkers(gray[y0:y1, x0:x1])
+            if ids is not None and (self.id1 in ids or self.id2 in ids):
+                self._sinceFull += 1
+                offset = np.array([x0, y0], dtype=np.float32)
+                return tuple(c + offset for c in corners), ids
+            # Lost in the crop, look at the whole frame
+        self._sinceFull = 0
+        return self._detectMarkers(gray)
+
+    def _coarseToFine(
+        self, gray: cv2.typing.MatLike
+    ) -> tuple[_typing.Sequence[cv2.typing.MatLike], cv2.typing.MatLike]:
+        coarse = cv2.resize(
+            gray,
+            None,
+            fx=self.pyramidFactor,
+            fy=self.pyramidFactor,
+            interpolation=cv2.INTER_AREA,
+        )
+        corners, ids = self._search(coarse)
+        found = [] if ids is None else ids.ravel().tolist()
+        if self.id1 not in found and self.id2 not in found:
+            # The small one may be readable at full resolution only, e.g. the big one partly out of frame
+            METRICS.count("aruco.pyramid.fallback")
+            return self._search(gray)
+        if self.id2 not in found:
+            # Side the small ArUco would have, from the big one
+            side = cv2.arcLength(corners[found.index(self.id1)], True) / 4
+            if side * self.arucoSize2 / self.arucoSize1 < self.pyramidMinSide:
+                METRICS.count("aruco.pyramid.fallback")
+                return self._search(gray)
+
+        # Back to full resolution, the searched ArUcos refined
+        scaleX = gray.shape[1] / coarse.shape[1]
+        scaleY = gray.shape[0] / coarse.shape[0]
+        corners = tuple(c * np.array([scaleX, scaleY], dtype=np.float32) for c in corners)
+        for j in range(len(corners)):
+            if ids[j][0] == self.id1 or ids[j][0] == self.id2:
+                cv2.cornerSubPix(
+                    gray,
+                    corners[j][0],
+                    (self.pyramidWindow, self.pyramidWindow),
+                    (-1, -1),
+                    SUBPIX_CRITERIA,
+                )
+        return corners, ids
+
+    def _track(
+        self, corners: _typing.Sequence[cv2.typing.MatLike], ids: cv2.typing.MatLike
+    ) -> None:
+        targets = [
+            corners[j][0]
+            for j in range(len(corners))
+            if ids[j][0] == self.id1 or ids[j][0] == self.id2
+        ] if ids is not None else []
+        if not targets:
+            self._box = None
+            self._velocity = np.zeros(2)
+            return
+        points = np.concatenate(targets)
+        box = np.concatenate([points.min(axis=0), points.max(axis=0)])
+        if self._box is not None:
+            center = (box[:2] + box[2:]) / 2
+            self._velocity = center - (self._box[:2] + self._box[2:]) / 2
+        self._box = box
+
+    def detect(
+        self, frame: cv2.typing.MatLike = None, force: bool = False
+    ) -> tuple[
+        _typing.Sequence[cv2.typing.MatLike], cv2.typing.MatLike, cv2.typing.MatLike
+    ]:
+        """Looking for ArUco, once per frame: later calls on the same frame reuse the result
+
+        Args:
+            frame (cv2.typing.MatLike, optional): New frame to work with. Defaults to self.frame.
+            force (bool, optional): Detect again even if this frame was already, e.g. after setProfile(). Defaults to False.
+
+        Returns:
+            tuple[_typing.Sequence[cv2.typing.MatLike], cv2.typing.MatLike, cv2.typing.MatLike]: ArUco corners in full resolution pixels, ids and the grayscale frame
+        """
+        if frame is not None:
+            self.frame = frame
+        if self._detectedFrame is self.frame and not force:
+            return self._detected
+        gray = self.grayOut()
+        self._scale = self.width / gray.shape[1]
+        tracked = self._flowTrack(gray) if self.flow else None
+        if tracked is not None:
+            corners, ids = tracked
+        else:
+            with METRICS.span("aruco.detect"):
+                if self.pyramid and gray.shape[1] >= self.pyramidMinWidth:
+                    corners, ids = self._coarseToFine(gray)
+                else:
+                    corners, ids = self._search(gray)
+            self._sinceDetect = 0
+        if self.flow:
+            self._flowKeep(gray, corners, ids)
+        # Frames decoded at a reduced scale are mapped back to width x height
+        if self._scale != 1:
+            corners = tuple(c * self._scale for c in corners)
+        if self.tracking:
+            self._track(corners, ids)
+        self._detectedFrame = self.frame
+        self._detected = (corners, ids, gray)
+        return self._detected
+
     def detector(
         self,
     ) -> tuple[
@@ -76,90 +550,129 @@ class ArucoProcess:
         """Looking for ArUco and mark them on frame
 
         Returns:
-            tuple[_typing.Sequence[cv2.typing.MatLike], cv2.typing.MatLike, cv2.typing.MatLike]: ArUco corners, ids and the frame with markers on it
+            tuple[_typing.Sequence[cv2.typing.MatLike], cv2.typing.MatLike, cv2.typing.MatLike]: ArUco corners in full resolution pixels, ids and the frame with markers on it
         """
-        (corners, ids, _) = cv2.aruco.detectMarkers(
-            self.grayOut(), self.arucoDict, parameters=self.arucoParams
-        )
-        return corners, ids, aruco.drawDetectedMarkers(self.frame, corners, ids)
-
-    def getPos(self, frame, corners, arID):
-        # --- 180 deg rotation matrix around the x axis
-        R_flip = np.zeros((3, 3), dtype=np.float32)
-        R_flip[0, 0] = 1.0
-        R_flip[1, 1] = -1.0
-        R_flip[2, 2] = -1.0
-
-        ret = aruco.estimatePoseSingleMarkers(
-            corners,
-            self.arucoSize1 / 10 if arID == self.id1 else self.arucoSize2 / 10,
-            self.matrix,
-            self.distortion,
+        corners, ids, _ = self.detect()
+        drawn = aruco.drawDetectedMarkers(
+            self.frame, tuple(c / self._scale for c in corners), ids
         )
-        rvec, tvec = ret[0][0, 0, :], ret[1][0, 0, :]
-        cv2.drawFrameAxes(frame, self.matrix, self.distortion, rvec, tvec, 1)
+        return corners, ids, drawn
 
-        R_ct = np.matrix(cv2.Rodrigues(rvec)[0])
-        R_tc = R_ct.T
-        roll_marker, pitch_marker, yaw_marker = rotationMatrixToEulerAngles(
-            R_flip * R_tc
-        )
-        self.rotaZion = math.degrees(yaw_marker)
+    def getPos(
+        self, corners: cv2.typing.MatLike, arID: int
+    ) -> tuple[np.ndarray, np.ndarray, tuple[float, float, float]]:
+        """Solve the 6-DoF pose of one marker
+
+        Args:
+            corners (cv2.typing.MatLike): 1x4x2 corners of this marker only
+            arID (int): ID of the marker, picks its real size
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, tuple[float, float, float]]: tvec in cm, rvec and roll, pitch, yaw in degrees
+        """
+        with METRICS.span("aruco.getPos"):
+            _, rvec, tvec = cv2.solvePnP(
+                self.objectPoints[arID],
+                corners.reshape(4, 2),
+                self.matrix,
+                self.distortion,
+                flags=cv2.SOLVEPNP_IPPE_SQUARE,
+            )
+            rvec, tvec = rvec.ravel(), tvec.ravel()
+
+            R_tc = cv2.Rodrigues(rvec)[0].T
+            roll, pitch, yaw = rotationMatrixToEulerAngles(R_FLIP @ R_tc)
+        return tvec, rvec, (math.degrees(roll), math.degrees(pitch), math.degrees(yaw))
 
-    def arucoDetected(self, frame):
-        self.frame = frame
-        _, ids, _ = self.detector()
-        if ids == None:
+    def arucoDetected(self, frame: cv2.typing.MatLike) -> bool:
+        """Check if one of the searched ArUcos is on the frame
+
+        Args:
+            frame (cv2.typing.MatLike): Frame from the cam
+
+        Returns:
+            bool: True if id1 or id2 is visible
+        """
+        _, ids, _ = self.detect(frame)
+        if ids is None:
             return False
         return self.id1 in ids or self.id2 in ids
 
     def getArucos(self, frame: cv2.typing.MatLike) -> None:
         """Retreive ArUcos and data on them and save it into self.dico
 
+        Center, yaw and size come straight from the corners. The 3D pose
+        (tvec, rvec, rpy) is solved too only when self.pose is on, see setPose().
+
         Args:
             frame (cv2.typing.MatLike): Frame from the cam
         """
-        self.frame = frame
-        aruco_perimeter = []
-        pixel_cm_ratio = []
-        actual_size = []
-
-        corners, ids, _ = self.detector()
-        # print(ids)
+        corners, ids, _ = self.detect(frame)
 
         self.dico = {}
-        if ids == None:
+        self.corners = {}
+        if ids is None:
             return
-        for j in range(len(ids)):
-            # print(f"curr : {ids[j]} : {88 in ids[j]}")
-            is81 = self.id1 in ids[j]
-            is88 = self.id2 in ids[j]
-            if not is81 and not is88 :
-                return
-            aruco_perimeter = cv2.arcLength(corners[j], True)
-            pixel_cm_ratio = aruco_perimeter / 20
-            size = (self.arucoSize1 if is81 else self.arucoSize2) / 10
-            actual_size = size / pixel_cm_ratio
-            a = corners[j][0][0]
-            b = corners[j][0][1]
-            c = corners[j][0][2]
-            d = corners[j][0][3]
-            points = [a, b, c, d]
-            Cx, Cy = calculer_centre(points)
-            Cx -= self.width // 2
-            Cy -= self.height // 2
-
-            if is81 or is88:
-                self.getPos(frame, corners, self.id2 if is88 else self.id1)
-
-            self.dico[ids[j][0]] = (
-                Cx,
-                -Cy,
-                self.rotaZion,
-                actual_size,
+        targets = [
+            j for j in range(len(ids)) if ids[j][0] == self.id1 or ids[j][0] == self.id2
+        ]
+        if not targets:
+            return
+        centers, yaws, perimeters = planarPose(
+            np.concatenate([corners[j].reshape(1, 4, 2) for j in targets])
+        )
+        centers -= (self.width // 2, self.height // 2)
+        for k, j in enumerate(targets):
+            arID = int(ids[j][0])
+            size = (self.arucoSize1 if arID == self.id1 else self.arucoSize2) / 10
+            pixel_cm_ratio = perimeters[k] / 20
+            self.corners[arID] = corners[j]
+            self.dico[arID] = ArucoData(
+                float(centers[k, 0]),
+                -float(centers[k, 1]),
+                float(yaws[k]),
+                float(size / pixel_cm_ratio),
             )
+            if self.pose:
+                self.poseOf(arID)
+        if self.target() is not None:
+            self.rotaZion = self.target().rotZ
+
+    def setPose(self, enabled: bool) -> None:
+        """Solve the 3D pose of every ArUco in getArucos(), or only on poseOf() calls
+
+        The autoland decisions only use cx, cy, rotZ and size, which do not
+        need the pose. With the pose, rotZ is the PnP yaw instead of the yaw
+        of the corners, within a fraction of a degree of each other on a
+        marker facing the camera.
+
+        Args:
+            enabled (bool): Solve the pose of every frame
+        """
+        self.pose = enabled
+
+    def poseOf(self, arID: int) -> ArucoData:
+        """Solve the 3D pose of an ArUco of the last getArucos(), e.g. for a final docking check
 
-        # print(self.dico.get(self.id) if self.id in self.dico.keys() else {})
+        Args:
+            arID (int): id1 or id2, must be in self.dico
+
+        Returns:
+            ArucoData: Entry of self.dico, completed with tvec, rvec, rpy and the PnP yaw
+        """
+        data = self.dico[arID]
+        if data.tvec is None:
+            tvec, rvec, rpy = self.getPos(self.corners[arID], arID)
+            data = self.dico[arID] = data._replace(rotZ=rpy[2], tvec=tvec, rvec=rvec, rpy=rpy)
+        return data
+
+    def target(self) -> tuple:
+        """Data of the ArUco to follow: the small one when visible, else the big one
+
+        Returns:
+            tuple: Entry of self.dico, None if neither is visible
+        """
+        return self.dico.get(self.id2, self.dico.get(self.id1))
 
     def lines(self, frame: cv2.typing.MatLike) -> cv2.typing.MatLike:
         """Draw HUD border lines
@@ -171,17 +684,14 @@ class ArucoProcess:
             cv2.typing.MatLike: Frame with lines drawn on it
         """
         thick = 3
+        target = self.target()
         # TOP
         frame = cv2.line(
             frame,
             self.TL,
             self.TR,
             coloration(
-                (
-                    self.dico.get(self.id)[1]
-                    if not self.dico.get(self.id) == None
-                    else -999
-                ),
+                target[1] if target is not None else -999,
                 True,
             ),
             thick,
@@ -192,11 +702,7 @@ class ArucoProcess:
             self.BL,
             self.BR,
             coloration(
-                (
-                    self.dico.get(self.id)[1]
-                    if not self.dico.get(self.id) == None
-                    else 999
-                ),
+                target[1] if target is not None else 999,
                 False,
             ),
             thick,
@@ -207,11 +713,7 @@ class ArucoProcess:
             self.TL,
             self.BL,
             coloration(
-                (
-                    self.dico.get(self.id)[0]
-                    if not self.dico.get(self.id) == None
-                    else 999
-                ),
+                target[0] if target is not None else 999,
                 False,
             ),
             thick,
@@ -222,11 +724,7 @@ class ArucoProcess:
             self.TR,
             self.BR,
             coloration(
-                (
-                    self.dico.get(self.id)[0]
-                    if not self.dico.get(self.id) == None
-                    else -999
-                ),
+                target[0] if target is not None else -999,
                 True,
             ),
             thick,
@@ -241,7 +739,7 @@ class ArucoProcess:
         """
         cv2.putText(
             self.lines(frame),
-            f"{self.dico}",
+            f"{ {arID: tuple(round(float(v), 1) for v in data[:4]) for arID, data in self.dico.items()} }",
             (3, 25),
             cv2.FONT_HERSHEY_SIMPLEX,
             0.5,
@@ -250,13 +748,26 @@ class ArucoProcess:
             cv2.LINE_AA,
         )
 
-    def showArucos(self):
-        """Display the captured frame with ArUco marked"""
+    def drawArucos(self) -> cv2.typing.MatLike:
+        """Mark the ArUcos, their axes and the HUD on the captured frame, without displaying it
+
+        Returns:
+            cv2.typing.MatLike: The frame with markers on it
+        """
         _, _, frame = self.detector()
 
-        self.hud(frame)
+        with METRICS.span("aruco.hud"):
+            for data in self.dico.values():
+                if data.rvec is not None:
+                    cv2.drawFrameAxes(
+                        frame, self.matrix, self.distortion, data.rvec, data.tvec, 1
+                    )
+            self.hud(frame)
+        return frame
 
-        cv2.imshow("ArUco Detection", frame)
+    def showArucos(self):
+        """Display the captured frame with ArUco marked"""
+        cv2.imshow("ArUco Detection", self.drawArucos())
 
 
 
@@ -0,0 +1,277 @@
+import asyncio
+import queue
+import threading
+import time
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from ArucoProcess import ArucoProcess, ArucoData
+from WebRequester import WebRequester
+from Metrics import METRICS
+from Exposure import ExposureController
+
+
+class LatestQueue:
+    def __init__(self, name: str = None) -> None:
+        """Single slot asyncio queue: put() replaces a value nobody read yet
+
+        Args:
+            name (str, optional): Counter of the replaced values in METRICS. Defaults to None.
+        """
+        self.name = name
+        self.dropped = 0
+        self._value = None
+        self._ready = asyncio.Event()
+
+    def put(self, value) -> None:
+        if self._ready.is_set():
+            self.dropped += 1
+            if self.name:
+                METRICS.count(self.name)
+        self._value = value
+        self._ready.set()
+
+    async def get(self):
+        await self._ready.wait()
+        self._ready.clear()
+        return self._value
+
+
+class AutolandEngine:
+    def __init__(
+        self,
+        requester: WebRequester,
+        processor: ArucoProcess,
+        bebop,
+        adaptive=None,
+        exposure: ExposureController = None,
+        strength: int = 10,
+        duration: float = 0.1,
+        maxAge: float = 0.5,
+        debug: bool = False,
+        lock: threading.Lock = None,
+        recorder=None,
+        profiles: tuple[str, str] = None,
+    ) -> None:
+        """Autolanding as three concurrent stages: capture, detection and commands
+
+        Each stage hands its newest result to the next through a LatestQueue, so
+        a slow stage makes the others skip stale values instead of queuing them.
+
+        Args:
+            requester (WebRequester): Camera requester, its capture thread must be started
+            processor (ArucoProcess): Detector, only used from the detection stage
+            bebop (Bebop): Connected drone
+            adaptive (AdaptiveQuality, optional): Quality controller run with each detection. Defaults to None.
+            exposure (ExposureController, optional): Flash LED controller run with each detection. Defaults to None.
+            strength (int, optional): fly_direct strength of the corrections. Defaults to 10.
+            duration (float, optional): fly_direct duration in seconds. Defaults to 0.1.
+            maxAge (float, optional): Oldest frame, in seconds, a command may rely on. Defaults to 0.5.
+            debug (bool, optional): Put the frames with ArUcos marked in self.display. Defaults to False.
+            lock (threading.Lock, optional): Held while using the processor, to share it with other threads. Defaults to a private lock.
+            recorder (SessionRecorder, optional): Records the fly_direct commands. Defaults to None.
+            profiles (tuple[str, str], optional): Detector profiles while approaching and once the small ArUco is seen, e.g. ("fast-approach", "precise-dock"). Defaults to None (left as is).
+        """
+        self.requester = requester
+        self.processor = processor
+        self.bebop = bebop
+        self.adaptive = adaptive
+        self.exposure = exposure
+        self.strength = strength
+        self.duration = duration
+        self.maxAge = maxAge
+        self.debug = debug
+        self.lock = lock if lock is not None else threading.Lock()
+        self.recorder = recorder
+        self.profiles = profiles
+        self.duty = 0
+        self.electro = False
+        self.prev = None
+        self._running = False
+        self._thread: threading.Thread = None
+        # Newest debug frame, shown by the caller on its GUI thread: HighGUI
+        # windows belong to the thread that made them, and each start() is a new one
+        self.display: queue.Queue[cv2.typing.MatLike] = queue.Queue(maxsize=1)
+
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> None:
+        """Run the stages on a background thread, so the caller keeps its own loop, e.g. Tk
+
+        A lost camera ends the thread with its error printed.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._runThread, daemon=True)
+        self._thread.start()
+
+    def _runThread(self) -> None:
+        try:
+            asyncio.run(self._stages())
+        except ConnectionError as e:
+            print(e)
+
+    def stop(self, timeout: float = None) -> None:
+        """Make the stages return after the current command
+
+        Args:
+            timeout (float, optional): Max wait in seconds for the thread of start() to end. Defaults to None (forever).
+        """
+        self._running = False
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    async def run(self) -> None:
+        """Run the stages until stop() is called or one of them fails
+
+        Raises:
+            ConnectionError: the camera was lost
+        """
+        self._running = True
+        await self._stages()
+
+    async def _stages(self) -> None:
+        # One thread per stage, a long command never delays the camera
+        self._capturePool = ThreadPoolExecutor(1, "capture")
+        self._detectPool = ThreadPoolExecutor(1, "detect")
+        self._commandPool = ThreadPoolExecutor(1, "command")
+        frames = LatestQueue("autoland.dropped.frames")
+        targets = LatestQueue("autoland.dropped.targets")
+        stages = [
+            asyncio.ensure_future(self._capture(frames)),
+            asyncio.ensure_future(self._detect(frames, targets)),
+            asyncio.ensure_future(self._control(targets)),
+        ]
+        try:
+            done, _ = await asyncio.wait(stages, return_when=asyncio.FIRST_COMPLETED)
+            for stage in done:
+                stage.result()
+        finally:
+            self._running = False
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            for pool in (self._capturePool, self._detectPool, self._commandPool):
+                pool.shutdown(cancel_futures=True)
+
+    async def _capture(self, frames: LatestQueue) -> None:
+        loop = asyncio.get_running_loop()
+        while self._running:
+            try:
+                img, stamp, quality = await loop.run_in_executor(
+                    self._capturePool, partial(self.requester.latest, 1.0)
+                )
+            except TimeoutError:
+                # No frame yet, look at self._running again
+                continue
+            frames.put((img, stamp, quality))
+
+    def _process(self, img: cv2.typing.MatLike, quality: str) -> tuple[ArucoData, bool]:
+        with self.lock:
+            if self.adaptive:
+                self.adaptive.prepare(quality)
+            self.processor.getArucos(img)
+            if self.adaptive:
+                self.adaptive.update()
+            if self.exposure:
+                # Grayscale image the detection just made, no extra conversion
+                _, _, gray = self.processor.detect()
+                self.exposure.update(img, gray)
+            if self.debug:
+                frame = self.processor.drawArucos()
+                try:
+                    self.display.get_nowait()
+                except queue.Empty:
+                    pass
+                self.display.put(frame)
+            seesSmall = self.processor.id2 in self.processor.dico
+            if self.profiles:
+                profile = self.profiles[1 if seesSmall else 0]
+                if profile != self.processor.profile:
+                    self.processor.setProfile(profile)
+            return self.processor.target(), seesSmall
+
+    async def _detect(self, frames: LatestQueue, targets: LatestQueue) -> None:
+        loop = asyncio.get_running_loop()
+        while self._running:
+            img, stamp, quality = await frames.get()
+            target, seesSmall = await loop.run_in_executor(
+                self._detectPool, self._process, img, quality
+            )
+            targets.put((stamp, target, seesSmall))
+
+    def decide(self, target: ArucoData) -> dict:
+        """Correction to apply for the followed ArUco
+
+        Args:
+            target (ArucoData): processor.target() of the newest frame
+
+        Returns:
+            dict: fly_direct arguments, None to hold
+        """
+        if target is None:
+            print("Hold")
+            return None
+        cx, cy, rotZ, _ = target[:4]
+        move = dict(roll=0, pitch=0, yaw=0, vertical_movement=0)
+        if abs(rotZ) > 10:
+            print("Rotate Left") if rotZ < 0 else print("Rotate Right")
+            move["yaw"] = -self.strength if rotZ < 0 else self.strength
+        elif abs(cx) > 20 or abs(cy) > 20:
+            # Both axes in one command instead of one blocking call each
+            if abs(cx) > 20:
+                print("Left") if cx > 0 else print("Right")
+                move["roll"] = -self.strength if cx > 0 else self.strength
+            if abs(cy) > 20:
+                print("Back") if cy > 0 else print("Front")
+                move["pitch"] = -self.strength if cy > 0 else self.strength
+        else:
+            print("Up")
+            move["vertical_movement"] = 5
+        return move
+
+    async def _control(self, targets: LatestQueue) -> None:
+        loop = asyncio.get_running_loop()
+
+        def timed(func, *args, **kwargs):
+            with METRICS.span(f"bebop.{func.__name__}"):
+                return func(*args, **kwargs)
+
+        def command(func, *args, **kwargs):
+            return loop.run_in_executor(
+                self._commandPool, partial(timed, func, *args, **kwargs)
+            )
+
+        while self._running:
+            stamp, target, seesSmall = await targets.get()
+            METRICS.tick("autoland.loop")
+
+            # Read here rather than queued, a skipped target never loses a change
+            if self.exposure and self.exposure.duty != self.duty:
+                self.duty = self.exposure.duty
+                await command(self.requester.setLight, self.duty)
+
+            if seesSmall and not self.electro:
+                await command(self.requester.TurnOnElectro)
+                self.electro = True
+
+            if target is not None:
+                self.prev = target
+            if time.time() - stamp > self.maxAge:
+                # The pose is too old to steer with, wait for a fresh one
+                METRICS.count("autoland.stale")
+                continue
+
+            move = self.decide(target)
+            if move is not None:
+                if self.recorder is not None:
+                    self.recorder.command("fly_direct", duration=self.duration, **move)
+                # Frame to command latency, fly_direct itself lasts self.duration
+                METRICS.observe("autoland.latency", time.time() - stamp)
+                await command(self.bebop.fly_direct, duration=self.duration, **move)
+                await command(self.bebop.ask_for_state_update)
+            # TODO: EXIT CONDITION
@@ -0,0 +1,189 @@
+import argparse
+import csv
+import glob
+import os
+import cv2
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from ArucoProcess import ArucoProcess
+from Calibration import Intrinsics, intrinsicsFor
+from Session import SessionReplay, INDEX_FILE
+
+COLUMNS = [
+    "source",
+    "frame",
+    "stamp",
+    "id",
+    "cx",
+    "cy",
+    "rotZ",
+    "size",
+    "side",
+    "tx",
+    "ty",
+    "tz",
+    "roll",
+    "pitch",
+    "yaw",
+]
+
+# Per worker process state, set by _init()
+_camera: Intrinsics = None
+_settings: dict = None
+_annotate: str = None
+_processors: dict[tuple[int, int], ArucoProcess] = {}
+_sessions: dict[str, SessionReplay] = {}
+
+
+def _init(camera: Intrinsics, settings: dict, annotate: str) -> None:
+    global _camera, _settings, _annotate
+    _camera = camera
+    _settings = settings
+    _annotate = annotate
+    # The detection already runs one frame per process
+    cv2.setNumThreads(1)
+
+
+def _processor(size: tuple[int, int]) -> ArucoProcess:
+    if size not in _processors:
+        camera = _camera.scaled(size)
+        _processors[size] = ArucoProcess(
+            camera.matrix, camera.distortion, *size, **_settings
+        )
+    return _processors[size]
+
+
+def _load(source: str, frame: int) -> tuple[cv2.typing.MatLike, float]:
+    if frame < 0:
+        return cv2.imread(source), float("nan")
+    if source not in _sessions:
+        _sessions[source] = SessionReplay(source, realtime=False)
+    replay = _sessions[source]
+    return cv2.imdecode(replay.jpeg(frame), cv2.IMREAD_COLOR), replay.stampOf(frame)
+
+
+def processFrame(task: tuple[str, int]) -> list[tuple]:
+    """Detect the searched ArUcos of one frame, in a worker process
+
+    Args:
+        task (tuple[str, int]): Image path and -1, or session folder and frame number
+
+    Returns:
+        list[tuple]: One COLUMNS row per searched ArUco, a row with id -1 if none is visible
+    """
+    source, frame = task
+    img, stamp = _load(source, frame)
+    if img is None:
+        return []
+    processor = _processor((img.shape[1], img.shape[0]))
+    processor.getArucos(img)
+    rows = []
+    for arID, data in processor.dico.items():
+        side = cv2.arcLength(processor.corners[arID], True) / 4
+        rows.append(
+            (source, frame, stamp, arID, *data[:4], side, *data.tvec, *data.rpy)
+        )
+    if not rows:
+        rows.append((source, frame, stamp, -1) + (float("nan"),) * 11)
+
+    if _annotate:
+        _, _, drawn = processor.detector()
+        processor.hud(drawn)
+        name = os.path.basename(os.path.normpath(source))
+        if frame >= 0:
+            name = f"{name}_{frame:06}.jpg"
+        cv2.imwrite(os.path.join(_annotate, name), drawn)
+    return rows
+
+
+def tasksOf(inputs: list[str]) -> list[tuple[str, int]]:
+    """Frames to process
+
+    Args:
+        inputs (list[str]): Images, folders searched recursively for .jpg, or session folders
+
+    Returns:
+        list[tuple[str, int]]: Image path and -1, or session folder and frame number
+    """
+    tasks = []
+    for path in inputs:
+        if os.path.exists(os.path.join(path, INDEX_FILE)):
+            try:
+                replay = SessionReplay(path, realtime=False)
+            except FileNotFoundError as e:
+                # Recorder closed before any frame came
+                print(e)
+                continue
+            tasks += [(path, frame) for frame in range(len(replay))]
+            replay.close()
+        elif os.path.isdir(path):
+            images = glob.glob(os.path.join(path, "**", "*.jpg"), recursive=True)
+            tasks += [(image, -1) for image in sorted(images)]
+        else:
+            tasks.append((path, -1))
+    return tasks
+
+
+def save(rows: list[tuple], output: str) -> None:
+    """Write the rows as CSV, or as a NumPy structured array if output ends with .npy or .npz
+
+    Args:
+        rows (list[tuple]): COLUMNS rows
+        output (str): Output file
+    """
+    if output.endswith((".npy", ".npz")):
+        dtype = [("source", f"U{max([len(r[0]) for r in rows] + [1])}"), ("frame", "i8")]
+        dtype += [("stamp", "f8"), ("id", "i4")] + [(c, "f8") for c in COLUMNS[4:]]
+        array = np.array(rows, dtype=dtype)
+        if output.endswith(".npz"):
+            np.savez_compressed(output, detections=array)
+        else:
+            np.save(output, array)
+        return
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Detect the ArUcos of images and recorded sessions, on every core"
+    )
+    parser.add_argument("inputs", nargs="+", help="Images, folders or session folders")
+    parser.add_argument("-o", "--output", default="detections.csv", help=".csv, .npy or .npz")
+    parser.add_argument("--annotate", help="Folder for the annotated frames")
+    parser.add_argument("--aruco-type", type=int, default=6, choices=[4, 5, 6, 7])
+    parser.add_argument("--size1", type=float, default=100, help="Big ArUco size in mm")
+    parser.add_argument("--size2", type=float, default=12.5, help="Small ArUco size in mm")
+    parser.add_argument("--id1", type=int, default=81)
+    parser.add_argument("--id2", type=int, default=88)
+    parser.add_argument("--camera", help="Calibration name of the camera")
+    parser.add_argument("--target-only", action="store_true", help="Match id1 and id2 codes only")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    tasks = tasksOf(args.inputs)
+    if args.annotate:
+        os.makedirs(args.annotate, exist_ok=True)
+    settings = dict(
+        arucoType=args.aruco_type,
+        arucoSize1=args.size1,
+        arucoSize2=args.size2,
+        id1=args.id1,
+        id2=args.id2,
+        targetOnly=args.target_only,
+    )
+    # Calibrated once here, scaled to each frame size in the workers
+    camera = intrinsicsFor("lo", camera=args.camera)
+    rows = []
+    with ProcessPoolExecutor(
+        args.workers, initializer=_init, initargs=(camera, settings, args.annotate)
+    ) as pool:
+        chunksize = max(1, len(tasks) // (4 * args.workers))
+        for frameRows in pool.map(processFrame, tasks, chunksize=chunksize):
+            rows += frameRows
+    save(rows, args.output)
+    found = sum(1 for row in rows if row[3] >= 0)
+    print(f"{len(tasks)} frames, {found} detections written to {args.output}")
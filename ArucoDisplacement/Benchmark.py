@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from cv2 import aruco
+
+from ArucoProcess import ArucoProcess
+from WebRequester import WebRequester, QUALITIES
+from CamEmulator import FrameSource
+from Calibration import intrinsicsFor
+from Session import SessionReplay, INDEX_FILE
+
+STAGES = ["decode", "grayOut", "detect", "getPos", "hud"]
+
+
+def percentiles(samples: list[int]) -> dict:
+    """Summarize stage durations
+
+    Args:
+        samples (list[int]): Durations in nanoseconds
+
+    Returns:
+        dict: count, mean, p50, p90, p99 and max in milliseconds
+    """
+    ms = np.array(samples, dtype=np.float64) / 1e6
+    if ms.size == 0:
+        return {"count": 0}
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {
+        "count": int(ms.size),
+        "mean": float(ms.mean()),
+        "p50": float(p50),
+        "p90": float(p90),
+        "p99": float(p99),
+        "max": float(ms.max()),
+    }
+
+
+def replay(
+    requester: WebRequester, processor: ArucoProcess, jpegs: list[bytes]
+) -> dict[str, list[int]]:
+    """Push every JPEG through the detection path, timing each stage
+
+    Args:
+        requester (WebRequester): Decodes the frames, as in flight
+        processor (ArucoProcess): Processor under test
+        jpegs (list[bytes]): Encoded frames
+
+    Returns:
+        dict[str, list[int]]: Durations in nanoseconds per stage name
+    """
+    times = {stage: [] for stage in STAGES}
+    clock = time.perf_counter_ns
+    for data in jpegs:
+        t0 = clock()
+        frame = requester.decode(data)
+        t1 = clock()
+        processor.frame = frame
+        gray = processor.grayOut()
+        t2 = clock()
+        corners, ids, _ = processor.detect(gray)
+        t3 = clock()
+        # Detection is cached for gray, only the pose part runs again
+        processor.getArucos(gray)
+        t4 = clock()
+        aruco.drawDetectedMarkers(frame, corners, ids)
+        processor.hud(frame)
+        t5 = clock()
+        times["decode"].append(t1 - t0)
+        times["grayOut"].append(t2 - t1)
+        times["detect"].append(t3 - t2)
+        if processor.dico:
+            times["getPos"].append(t4 - t3)
+        times["hud"].append(t5 - t4)
+    return times
+
+
+def benchmark(
+    jpegsByQuality: dict[str, list[bytes]],
+    arucoTypes: list[int],
+    repeat: int,
+    id1: int,
+    id2: int,
+    targetOnly: bool = False,
+    pyramid: bool = False,
+    flow: bool = False,
+    pose: bool = True,
+) -> list[dict]:
+    """Benchmark every quality and dictionary combination
+
+    Args:
+        jpegsByQuality (dict[str, list[bytes]]): Encoded frames per quality
+        arucoTypes (list[int]): ArucoProcess arucoType values to test
+        repeat (int): Passes over the frames, after one warm-up pass
+        id1 (int): Big ArUco ID
+        id2 (int): Small ArUco ID
+        targetOnly (bool, optional): Detect with the id1/id2 only dictionary. Defaults to False.
+        pyramid (bool, optional): Detect large frames coarse to fine. Defaults to False.
+        flow (bool, optional): Follow the corners with optical flow between detections. Defaults to False.
+        pose (bool, optional): Solve the 3D pose of every frame. Defaults to True.
+
+    Returns:
+        list[dict]: One result per combination, JSON ready
+    """
+    results = []
+    for quality, jpegs in jpegsByQuality.items():
+        camera = intrinsicsFor(quality)
+        for arucoType in arucoTypes:
+            requester = WebRequester(quality)
+            processor = ArucoProcess(
+                camera.matrix,
+                camera.distortion,
+                camera.size[0],
+                camera.size[1],
+                arucoType=arucoType,
+                id1=id1,
+                id2=id2,
+                targetOnly=targetOnly,
+                pyramid=pyramid,
+                flow=flow,
+                pose=pose,
+            )
+            replay(requester, processor, jpegs)
+            times = {stage: [] for stage in STAGES}
+            for _ in range(repeat):
+                for stage, samples in replay(requester, processor, jpegs).items():
+                    times[stage].extend(samples)
+
+            # Separate pass, tracemalloc slows allocations down
+            tracemalloc.start()
+            replay(requester, processor, jpegs)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            frames = len(jpegs) * repeat
+            total = sum(sum(samples) for samples in times.values()) / 1e9
+            results.append(
+                {
+                    "quality": quality,
+                    "arucoType": arucoType,
+                    "targetOnly": targetOnly,
+                    "pyramid": pyramid,
+                    "flow": flow,
+                    "pose": pose,
+                    "frames": frames,
+                    "fps": frames / total if total else None,
+                    "peakTracedBytes": peak,
+                    "stages": {stage: percentiles(times[stage]) for stage in STAGES},
+                }
+            )
+    return results
+
+
+def maxRss() -> int:
+    """Peak resident memory of the process in KiB, None where unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def folderFrames(folder: str, qualities: list[str]) -> dict[str, list[bytes]]:
+    """Encode the frames of a folder at each quality, like the firmware would send them
+
+    Args:
+        folder (str): Folder holding .jpg frames
+        qualities (list[str]): lo, mid and/or hi
+
+    Returns:
+        dict[str, list[bytes]]: Encoded frames per quality
+    """
+    source = FrameSource(folder)
+    return {
+        quality: [source.next(quality) for _ in source.images] for quality in qualities
+    }
+
+
+def sessionFrames(folder: str, qualities: list[str]) -> dict[str, list[bytes]]:
+    """Recorded frames of a session, as the camera sent them
+
+    Args:
+        folder (str): Session folder written by SessionRecorder
+        qualities (list[str]): Qualities to keep
+
+    Returns:
+        dict[str, list[bytes]]: Encoded frames per quality
+    """
+    replay = SessionReplay(folder, realtime=False)
+    frames = {quality: [] for quality in qualities}
+    for frame in range(len(replay)):
+        quality = replay.frameQualityOf(frame)
+        if quality in frames:
+            frames[quality].append(replay.jpeg(frame).tobytes())
+    replay.close()
+    return {quality: jpegs for quality, jpegs in frames.items() if jpegs}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per-stage latency of the detection path over recorded frames"
+    )
+    parser.add_argument(
+        "source",
+        nargs="?",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Images"),
+        help="Folder of .jpg frames or recorded session",
+    )
+    parser.add_argument("--quality", nargs="+", default=list(QUALITIES))
+    parser.add_argument("--aruco-type", nargs="+", type=int, default=[4, 5, 6, 7])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--id1", type=int, default=81)
+    parser.add_argument("--id2", type=int, default=88)
+    parser.add_argument("--target-only", action="store_true", help="Match id1 and id2 codes only")
+    parser.add_argument("--pyramid", action="store_true", help="Detect hi frames coarse to fine")
+    parser.add_argument("--flow", action="store_true", help="Optical flow between detections")
+    parser.add_argument("--no-pose", action="store_true", help="Image plane data only, no PnP")
+    parser.add_argument("--output", help="JSON file, stdout by default")
+    args = parser.parse_args()
+    if os.path.exists(os.path.join(args.source, INDEX_FILE)):
+        frames = sessionFrames(args.source, args.quality)
+    else:
+        frames = folderFrames(args.source, args.quality)
+
+    report = {
+        "source": args.source,
+        "opencv": cv2.__version__,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "threads": cv2.getNumThreads(),
+        "results": benchmark(
+            frames,
+            args.aruco_type,
+            args.repeat,
+            args.id1,
+            args.id2,
+            args.target_only,
+            args.pyramid,
+            args.flow,
+            not args.no_pose,
+        ),
+        "maxRssKiB": maxRss(),
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
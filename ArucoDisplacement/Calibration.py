@@ -2,14 +2,167 @@ import cv2
 import numpy as np
 import os
 import glob
+import hashlib
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from WebRequester import WebRequester
+from WebRequester import WebRequester, QUALITIES, sizePicker
 
-def calibrate(display:bool) -> tuple[cv2.typing.MatLike, cv2.typing.MatLike]:
-    # Defining the dimensions of checkerboard
-    CHECKERBOARD = (6, 9)
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+# Calibration results, keyed by the hash of their inputs
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".calibration")
+
+
+def fileHash(fname: str) -> str:
+    """Hash the content of a file
+
+    Args:
+        fname (str): Path of the file
+
+    Returns:
+        str: sha256 hex digest
+    """
+    with open(fname, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def calibrationKey(hashes: list[str], *settings) -> str:
+    """Identify a calibration by its images content and settings
+
+    Args:
+        hashes (list[str]): fileHash() of every calibration image
+        settings: Any other input changing the result (checkerboard, criteria...)
+
+    Returns:
+        str: sha256 hex digest
+    """
+    h = hashlib.sha256(repr(settings).encode())
+    for digest in sorted(hashes):
+        h.update(digest.encode())
+    return h.hexdigest()
+
+
+# Defining the dimensions of checkerboard
+CHECKERBOARD = (6, 9)
+CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+def findCorners(fname: str) -> tuple[bool, np.ndarray, tuple[int, int]]:
+    """Find and refine the checkerboard corners of one image
+
+    Args:
+        fname (str): Path of the image
+
+    Returns:
+        tuple[bool, np.ndarray, tuple[int, int]]: Found flag, refined corners and image size (w, h)
+    """
+    img = cv2.imread(fname)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    # Find the chess board corners
+    # If desired number of corners are found in the image then ret = true
+    ret, corners = cv2.findChessboardCorners(
+        gray,
+        CHECKERBOARD,
+        cv2.CALIB_CB_ADAPTIVE_THRESH
+        + cv2.CALIB_CB_FAST_CHECK
+        + cv2.CALIB_CB_NORMALIZE_IMAGE,
+    )
+    if ret:
+        # refining pixel coordinates for given 2d points.
+        corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), CRITERIA)
+    return ret, corners, gray.shape[::-1]
+
+
+def cornersOf(
+    images: list[str], hashes: list[str], cache: bool = True
+) -> list[tuple[bool, np.ndarray, tuple[int, int]]]:
+    """findCorners() on every image, spread over a thread pool
+
+    OpenCV releases the GIL while reading and searching, so threads use every
+    core without re-importing the calling script like spawned processes would.
+
+    Args:
+        images (list[str]): Paths of the calibration images
+        hashes (list[str]): fileHash() of each image, key of its saved corners
+        cache (bool, optional): Only process images whose corners were never saved. Defaults to True.
+
+    Returns:
+        list[tuple[bool, np.ndarray, tuple[int, int]]]: findCorners() result of each image, in order
+    """
+    folder = os.path.join(CACHE_DIR, "corners")
+    settings = hashlib.sha256(repr((CHECKERBOARD, CRITERIA)).encode()).hexdigest()[:16]
+    paths = [os.path.join(folder, f"{digest}_{settings}.npz") for digest in hashes]
+    results = [None] * len(images)
+    todo = []
+    for i, path in enumerate(paths):
+        if cache and os.path.exists(path):
+            with np.load(path) as saved:
+                results[i] = (bool(saved["ret"]), saved["corners"], tuple(saved["size"]))
+        else:
+            todo.append(i)
+
+    if len(todo) > 1:
+        with ThreadPoolExecutor(os.cpu_count()) as pool:
+            found = list(pool.map(findCorners, [images[i] for i in todo]))
+    else:
+        found = [findCorners(images[i]) for i in todo]
+
+    if cache and todo:
+        os.makedirs(folder, exist_ok=True)
+    for i, result in zip(todo, found):
+        results[i] = result
+        if cache:
+            ret, corners, size = result
+            np.savez(
+                paths[i],
+                ret=ret,
+                corners=corners if ret else np.empty((0, 1, 2), np.float32),
+                size=size,
+            )
+    return results
+
+
+def calibrate(display:bool, cache:bool = True) -> tuple[cv2.typing.MatLike, cv2.typing.MatLike]:
+    """Compute the camera matrix and distortion from the checkerboard captures
+
+    Args:
+        display (bool): Show each image with its corners and print the results
+        cache (bool, optional): Reuse saved corners and results when images and settings did not change. Defaults to True.
+
+    Returns:
+        tuple[cv2.typing.MatLike, cv2.typing.MatLike]: Camera matrix and distortion
+    """
+    mtx, dist, _ = calibrateImages(capPattern("lo"), display, cache)
+    return mtx, dist
+
+
+def calibrateImages(
+    pattern: str, display: bool, cache: bool = True
+) -> tuple[cv2.typing.MatLike, cv2.typing.MatLike, tuple[int, int]]:
+    """Compute the camera matrix and distortion from the captures matching a pattern
+
+    Args:
+        pattern (str): Recursive glob of the checkerboard captures
+        display (bool): Show each image with its corners and print the results
+        cache (bool, optional): Reuse saved corners and results when images and settings did not change. Defaults to True.
+
+    Raises:
+        FileNotFoundError: no image matches the pattern
+
+    Returns:
+        tuple[cv2.typing.MatLike, cv2.typing.MatLike, tuple[int, int]]: Camera matrix, distortion and image size (w, h)
+    """
+    # Extracting path of individual image stored in a given directory
+    images = sorted(glob.glob(pattern, recursive=True))
+    if not images:
+        raise FileNotFoundError(f"No calibration image matches {pattern}")
+    hashes = [fileHash(fname) for fname in images]
+
+    cachePath = os.path.join(
+        CACHE_DIR, f"{calibrationKey(hashes, CHECKERBOARD, CRITERIA)}.npz"
+    )
+    if cache and not display and os.path.exists(cachePath):
+        with np.load(cachePath) as saved:
+            return saved["mtx"], saved["dist"], tuple(int(v) for v in saved["size"])
 
     # Creating vector to store vectors of 3D points for each checkerboard image
     objpoints = []
@@ -20,46 +173,26 @@ def calibrate(display:bool) -> tuple[cv2.typing.MatLike, cv2.typing.MatLike]:
     # Defining the world coordinates for 3D points
     objp = np.zeros((1, CHECKERBOARD[0] * CHECKERBOARD[1], 3), np.float32)
     objp[0, :, :2] = np.mgrid[0 : CHECKERBOARD[0], 0 : CHECKERBOARD[1]].T.reshape(-1, 2)
-    prev_img_shape = None
-
-    # Extracting path of individual image stored in a given directory
-    images = glob.glob("**/Capture_*.jpg", recursive=True)
-    for fname in images:
-        img = cv2.imread(fname)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        # Find the chess board corners
-        # If desired number of corners are found in the image then ret = true
-        ret, corners = cv2.findChessboardCorners(
-            gray,
-            CHECKERBOARD,
-            cv2.CALIB_CB_ADAPTIVE_THRESH
-            + cv2.CALIB_CB_FAST_CHECK
-            + cv2.CALIB_CB_NORMALIZE_IMAGE,
-        )
 
+    for fname, (ret, corners, size) in zip(images, cornersOf(images, hashes, cache)):
         """
         If desired number of corner are detected,
-        we refine the pixel coordinates and display 
+        we keep the refined pixel coordinates and display 
         them on the images of checker board
         """
-        if ret == True:
+        if ret:
             objpoints.append(objp)
-            # refining pixel coordinates for given 2d points.
-            corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
-
-            imgpoints.append(corners2)
+            imgpoints.append(corners)
 
         if display:
             # Draw and display the corners
-            img = cv2.drawChessboardCorners(img, CHECKERBOARD, corners2, ret)
+            img = cv2.drawChessboardCorners(cv2.imread(fname), CHECKERBOARD, corners, ret)
             cv2.imshow("img", img)
             cv2.waitKey(0)
 
     if display:
         cv2.destroyAllWindows()
 
-    # h, w = img.shape[:2]
-
     """
     Performing camera calibration by 
     passing the value of known 3D points (objpoints)
@@ -67,7 +200,7 @@ def calibrate(display:bool) -> tuple[cv2.typing.MatLike, cv2.typing.MatLike]:
     detected corners (imgpoints)
     """
     ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(
-        objpoints, imgpoints, gray.shape[::-1], None, None
+        objpoints, imgpoints, size, None, None
     )
 
     if display:
@@ -80,8 +213,127 @@ def calibrate(display:bool) -> tuple[cv2.typing.MatLike, cv2.typing.MatLike]:
         print(rvecs)
         print("\ntvecs :")
         print(tvecs)
-    
-    return mtx, dist
+
+    if cache:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        np.savez(cachePath, mtx=mtx, dist=dist, size=size)
+
+    return mtx, dist, tuple(int(v) for v in size)
+
+
+class Intrinsics:
+    def __init__(
+        self,
+        matrix: cv2.typing.MatLike,
+        distortion: cv2.typing.MatLike,
+        size: tuple[int, int],
+    ) -> None:
+        """Camera model valid for one frame size
+
+        Args:
+            matrix (cv2.typing.MatLike): Camera matrix
+            distortion (cv2.typing.MatLike): Distortion coefficients
+            size (tuple[int, int]): Frame size (w, h) the matrix applies to
+        """
+        self.matrix = matrix
+        self.distortion = distortion
+        self.size = size
+        self._maps = None
+
+    def scaled(self, size: tuple[int, int]) -> "Intrinsics":
+        """Same camera at another frame size
+
+        Pixels stay square: both axes take the width ratio. When the aspect
+        ratio changes, the frames are taken as a centred crop of the sensor,
+        as the OV2640 does for 720p, and cy moves with the cropped rows.
+
+        Args:
+            size (tuple[int, int]): New frame size (w, h)
+
+        Returns:
+            Intrinsics: Intrinsics for that size, self if the size did not change
+        """
+        if tuple(size) == tuple(self.size):
+            return self
+        scale = size[0] / self.size[0]
+        # Rows cut from (or added to) each side of the scaled frame
+        crop = (self.size[1] * scale - size[1]) / 2
+        matrix = np.array(self.matrix, dtype=np.float64)
+        matrix[:2, :2] *= scale
+        # Pixel centers move with the half pixel offset
+        matrix[0, 2] = (matrix[0, 2] + 0.5) * scale - 0.5
+        matrix[1, 2] = (matrix[1, 2] + 0.5) * scale - 0.5 - crop
+        return Intrinsics(matrix, self.distortion, tuple(size))
+
+    def maps(self) -> tuple[cv2.typing.MatLike, cv2.typing.MatLike]:
+        """Undistortion maps for remap(), computed on first use
+
+        Returns:
+            tuple[cv2.typing.MatLike, cv2.typing.MatLike]: Fixed point map and interpolation table
+        """
+        if self._maps is None:
+            self._maps = cv2.initUndistortRectifyMap(
+                self.matrix, self.distortion, None, self.matrix, self.size, cv2.CV_16SC2
+            )
+        return self._maps
+
+    def undistort(self, frame: cv2.typing.MatLike) -> cv2.typing.MatLike:
+        """Undistort a whole frame with the precomputed maps
+
+        Args:
+            frame (cv2.typing.MatLike): Frame of self.size
+
+        Returns:
+            cv2.typing.MatLike: Undistorted frame, same camera matrix
+        """
+        map1, map2 = self.maps()
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR)
+
+    def undistortPoints(self, points: cv2.typing.MatLike) -> cv2.typing.MatLike:
+        """Undistort pixel coordinates only, far cheaper than a whole frame
+
+        Args:
+            points (cv2.typing.MatLike): Nx1x2 or 1xNx2 pixel coordinates, e.g. ArUco corners
+
+        Returns:
+            cv2.typing.MatLike: Undistorted pixel coordinates, same shape
+        """
+        pts = np.asarray(points, dtype=np.float32)
+        return cv2.undistortPoints(
+            pts.reshape(-1, 1, 2), self.matrix, self.distortion, P=self.matrix
+        ).reshape(pts.shape)
+
+
+_INTRINSICS: dict[tuple[str, str], Intrinsics] = {}
+
+
+def intrinsicsFor(quality: str, cache: bool = True, camera: str = None) -> Intrinsics:
+    """Camera model for a WebRequester quality
+
+    Captures taken at that quality (see capPattern()) are calibrated on their
+    own. Without any, the lo calibration of the same camera is scaled to the
+    quality frame size, see Intrinsics.scaled().
+
+    Args:
+        quality (str): lo, mid or hi
+        cache (bool, optional): Reuse saved calibrations. Defaults to True.
+        camera (str, optional): Name of the camera, see capPrefix(). Defaults to None (main camera).
+
+    Raises:
+        FileNotFoundError: the camera has no capture at all
+
+    Returns:
+        Intrinsics: Camera model for frames of sizePicker(quality)
+    """
+    if (camera, quality) not in _INTRINSICS:
+        pattern = capPattern(quality, camera)
+        if not glob.glob(pattern, recursive=True):
+            pattern = capPattern("lo", camera)
+        mtx, dist, calibSize = calibrateImages(pattern, False, cache)
+        _INTRINSICS[(camera, quality)] = Intrinsics(mtx, dist, calibSize).scaled(
+            sizePicker(quality)
+        )
+    return _INTRINSICS[(camera, quality)]
 
 
 class CALIBRATION_MODE(Enum):
@@ -89,25 +341,36 @@ class CALIBRATION_MODE(Enum):
     PROCESS = 1
 
 
-def capName(number) -> str:
-    if number < 10:
-        return f"Capture_00{number}"
-    elif number < 100:
-        return f"Capture_0{number}"
-    else:
-        return f"Capture_{number}"
+def capPrefix(quality: str, camera: str = None) -> str:
+    if camera:
+        # Cam-... never matches the patterns of the main camera
+        return f"Cam-{camera}" if quality == "lo" else f"Cam-{camera}-{quality}"
+    # lo captures keep the historical name
+    return "Capture" if quality == "lo" else f"Capture-{quality}"
+
+
+def capPattern(quality: str, camera: str = None) -> str:
+    return f"**/{capPrefix(quality, camera)}_*.jpg"
+
+
+def capName(number, quality: str = "lo", camera: str = None) -> str:
+    return f"{capPrefix(quality, camera)}_{number:03}"
 
 
 if __name__ == "__main__":
     mode = None
-    if len(sys.argv) <= 1 or sys.argv[1].lower() not in ["capture", "process"]:
-        print("python Calibration.py (capture|process)")
+    quality = sys.argv[2].lower() if len(sys.argv) > 2 else "lo"
+    camera = sys.argv[3] if len(sys.argv) > 3 else None
+    host = sys.argv[4] if len(sys.argv) > 4 else None
+    if len(sys.argv) <= 1 or sys.argv[1].lower() not in ["capture", "process"] or quality not in QUALITIES:
+        print("python Calibration.py (capture|process) [lo|mid|hi] [camera name] [camera host]")
     else:
         mode = CALIBRATION_MODE.CAPTURE if sys.argv[1].lower() == "capture" else CALIBRATION_MODE.PROCESS
 
     if mode == CALIBRATION_MODE.CAPTURE:
-        requester = WebRequester("lo")
-        num = 1
+        requester = WebRequester(quality, host=host)
+        folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Images")
+        num = len(glob.glob(os.path.join(folder, f"{capPrefix(quality, camera)}_*.jpg"))) + 1
         while True:
             im = requester.request()
             cv2.imshow("live Cam Capturing", im)
@@ -115,9 +378,9 @@ if __name__ == "__main__":
             if key == ord("q"):
                 break
             elif key == ord("s"):
-                name = f"**/Images/{capName(num)}.jpg"
+                name = os.path.join(folder, f"{capName(num, quality, camera)}.jpg")
                 cv2.imwrite(name, im)
                 num += 1
         cv2.destroyAllWindows()
     elif mode == CALIBRATION_MODE.PROCESS:
-        calibrate(True)
\ No newline at end of file
+        calibrateImages(capPattern(quality, camera), True)
\ No newline at end of file
@@ -0,0 +1,289 @@
+import argparse
+import glob
+import os
+import random
+import threading
+import time
+import cv2
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from WebRequester import QUALITIES, sizePicker, STREAM_PORT
+
+BOUNDARY = "e8b8c539-047d-4777-a985-fbba6edff11e"  # Same as the esp32cam library
+
+
+class FrameSource:
+    def __init__(self, folder: str, jpegQuality: int = 80) -> None:
+        """Loop over the JPEG files of a folder, like a camera filming them
+
+        Args:
+            folder (str): Folder holding the .jpg frames
+            jpegQuality (int, optional): Re-encoding quality, as cfg.setJpeg() in the firmware. Defaults to 80.
+
+        Raises:
+            FileNotFoundError: the folder holds no .jpg file
+        """
+        paths = sorted(glob.glob(os.path.join(folder, "*.jpg")))
+        if not paths:
+            raise FileNotFoundError(f"No .jpg frame in {folder}")
+        self.images = [cv2.imread(path) for path in paths]
+        self.jpegQuality = jpegQuality
+        self._encoded: dict[tuple[str, int], bytes] = {}
+        self._index = 0
+        self._lock = threading.Lock()
+
+    def next(self, quality: str) -> bytes:
+        """Return the next frame encoded at the firmware size of a quality
+
+        Args:
+            quality (str): lo, mid or hi
+
+        Returns:
+            bytes: JPEG data
+        """
+        with self._lock:
+            index = self._index
+            self._index = (index + 1) % len(self.images)
+            key = (quality, index)
+            if key not in self._encoded:
+                img = cv2.resize(self.images[index], sizePicker(quality))
+                _, buf = cv2.imencode(
+                    ".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, self.jpegQuality]
+                )
+                self._encoded[key] = buf.tobytes()
+            return self._encoded[key]
+
+
+# Firmware switch routes: output, value written and answer
+SWITCHES = {
+    "/led/on": ("led", 10, "LED ON"),
+    "/led/off": ("led", 0, "LED OFF"),
+    "/electro/on": ("electro", 1, "R ON"),
+    "/electro/off": ("electro", 0, "R OFF"),
+}
+
+
+class Faults:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        bandwidth: float = 0.0,
+        failRate: float = 0.0,
+        dropRate: float = 0.0,
+        seed: int = None,
+    ) -> None:
+        """Wi-Fi and camera trouble injected in the answers
+
+        Args:
+            latency (float, optional): Delay before each answer, in seconds. Defaults to 0.0.
+            jitter (float, optional): Uniform spread around latency and the stream period, in seconds. Defaults to 0.0.
+            bandwidth (float, optional): Cap in bytes per second, 0 for none. Defaults to 0.0.
+            failRate (float, optional): Share of captures answered 503, as a CAPTURE FAIL of the firmware. Defaults to 0.0.
+            dropRate (float, optional): Share of requests, or stream frames, whose connection is cut. Defaults to 0.0.
+            seed (int, optional): Random seed, for repeatable runs. Defaults to None.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.failRate = failRate
+        self.dropRate = dropRate
+        self._random = random.Random(seed)
+
+    def spread(self) -> float:
+        return self._random.uniform(-self.jitter, self.jitter) if self.jitter else 0.0
+
+    def delay(self) -> float:
+        return max(0.0, self.latency + self.spread())
+
+    def fails(self) -> bool:
+        return self.failRate > 0 and self._random.random() < self.failRate
+
+    def drops(self) -> bool:
+        return self.dropRate > 0 and self._random.random() < self.dropRate
+
+
+class CamHandler(BaseHTTPRequestHandler):
+    """Serve the firmware routes: /<quality>.jpg stills, /<quality>.mjpeg streams, LED duty and switches"""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    source: FrameSource = None
+    fps = 20.0
+    faults = Faults()
+    outputs = {"led": 0, "electro": 0}
+
+    def do_GET(self) -> None:
+        delay = self.faults.delay()
+        if delay:
+            time.sleep(delay)
+        if self.faults.drops():
+            # Gone before answering, as a Wi-Fi drop
+            self.close_connection = True
+            return
+        route, _, query = self.path.partition("?")
+        quality, _, ext = route.lstrip("/").partition(".")
+        try:
+            if route in SWITCHES:
+                self.serveSwitch(*SWITCHES[route])
+            elif route == "/led":
+                self.serveDuty(parse_qs(query).get("duty"))
+            elif quality in QUALITIES and ext == "jpg":
+                self.serveJpg(quality)
+            elif quality in QUALITIES and ext == "mjpeg":
+                self.serveMjpeg(quality)
+            else:
+                self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def send(self, data: bytes) -> None:
+        """Write data, no faster than the bandwidth cap"""
+        if not self.faults.bandwidth:
+            self.wfile.write(data)
+            return
+        # 20 ms slices keep the pace smooth
+        step = max(1, int(self.faults.bandwidth / 50))
+        for start in range(0, len(data), step):
+            chunk = data[start : start + step]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / self.faults.bandwidth)
+
+    def serveSwitch(self, output: str, value: int, msg: str) -> None:
+        self.outputs[output] = value
+        print(msg)
+        data = msg.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.send(data)
+
+    def serveDuty(self, duty: list[str]) -> None:
+        if not duty or not duty[0].lstrip("-").isdigit():
+            self.send_error(400, "DUTY MISSING")
+            return
+        duty = min(max(int(duty[0]), 0), 255)
+        self.serveSwitch("led", duty, "LED OFF" if duty == 0 else "LED ON")
+
+    def serveJpg(self, quality: str) -> None:
+        if self.faults.fails():
+            print("CAPTURE FAIL")
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        data = self.source.next(quality)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.faults.drops():
+            # Cut in the middle of the body
+            self.send(data[: len(data) // 2])
+            self.close_connection = True
+            return
+        self.send(data)
+
+    def serveMjpeg(self, quality: str) -> None:
+        self.close_connection = True
+        if self.faults.fails():
+            print("CAPTURE FAIL")
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", f"multipart/x-mixed-replace;boundary={BOUNDARY}"
+        )
+        self.end_headers()
+        period = 1 / self.fps
+        while True:
+            start = time.monotonic()
+            data = self.source.next(quality)
+            if self.faults.drops():
+                self.send(data[: len(data) // 2])
+                return
+            self.send(
+                b"Content-Type: image/jpeg\r\n"
+                + f"Content-Length: {len(data)}\r\n\r\n".encode()
+                + data
+                + f"\r\n--{BOUNDARY}\r\n".encode()
+            )
+            wait = period - (time.monotonic() - start) + self.faults.spread()
+            time.sleep(max(0.0, wait))
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve(
+    folder: str,
+    host: str,
+    port: int,
+    streamPort: int,
+    fps: float,
+    faults: Faults = None,
+) -> None:
+    """Run the stand-in until Ctrl+C, stills on port and streams on streamPort
+
+    Args:
+        folder (str): Folder holding the .jpg frames
+        host (str): Address to bind
+        port (int): Port of the still and switch routes, 80 on the firmware
+        streamPort (int): Port of the stream routes, 81 on the firmware
+        fps (float): Stream frame rate
+        faults (Faults, optional): Trouble to inject. Defaults to none.
+    """
+    handler = type(
+        "Handler",
+        (CamHandler,),
+        {
+            "source": FrameSource(folder),
+            "fps": fps,
+            "faults": faults or Faults(),
+            "outputs": {"led": 0, "electro": 0},
+        },
+    )
+    servers = [ThreadingHTTPServer((host, p), handler) for p in (port, streamPort)]
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving {folder} on http://{host}:{port} (stills) and :{streamPort} (MJPEG)")
+    print(f"Point the clients at it with CAM_HOST={host}:{port} CAM_STREAM_PORT={streamPort}")
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        pass
+    for server in servers:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ESP32-CAM stand-in")
+    parser.add_argument(
+        "folder",
+        nargs="?",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Images"),
+    )
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=80)
+    parser.add_argument("--stream-port", type=int, default=STREAM_PORT)
+    parser.add_argument("--fps", type=float, default=20.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="ms")
+    parser.add_argument("--jitter", type=float, default=0.0, help="ms")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="KiB/s, 0 for none")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Share of cut connections")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    faults = Faults(
+        args.latency / 1000,
+        args.jitter / 1000,
+        args.bandwidth * 1024,
+        args.fail_rate,
+        args.drop_rate,
+        args.seed,
+    )
+    serve(args.folder, args.host, args.port, args.stream_port, args.fps, faults)
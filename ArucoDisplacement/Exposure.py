@@ -0,0 +1,92 @@
+import time
+import cv2
+
+
+class ExposureController:
+    def __init__(
+        self,
+        low: float = 60,
+        high: float = 120,
+        step: int = 32,
+        maxDuty: int = 255,
+        stride: int = 8,
+        period: float = 0.5,
+        smoothing: float = 0.5,
+    ) -> None:
+        """Drive the flash LED duty to keep the ceiling bright enough for detection
+
+        Brightness is the mean of one pixel every stride rows and columns, of the
+        grayscale image the detector already made when given, else of the frame.
+        The duty steps up under low and down over high: frames between the two
+        thresholds leave it unchanged, so the LED does not flicker around one level.
+
+        Args:
+            low (float, optional): Mean gray level under which the LED gets brighter. Defaults to 60.
+            high (float, optional): Mean gray level over which the LED gets dimmer. Defaults to 120.
+            step (int, optional): Duty change per decision. Defaults to 32.
+            maxDuty (int, optional): Highest duty, 255 is the full power of the firmware PWM. Defaults to 255.
+            stride (int, optional): Subsampling step in pixels. Defaults to 8.
+            period (float, optional): Seconds between two decisions, lets the camera settle. Defaults to 0.5.
+            smoothing (float, optional): Weight of the new measure in the brightness average. Defaults to 0.5.
+        """
+        self.low = low
+        self.high = high
+        self.step = step
+        self.maxDuty = maxDuty
+        self.stride = stride
+        self.period = period
+        self.smoothing = smoothing
+        self.duty = 0
+        self.level: float = None
+        self._last = 0.0
+
+    def brightness(
+        self, frame: cv2.typing.MatLike, gray: cv2.typing.MatLike = None
+    ) -> float:
+        """Mean gray level of a strided subsample
+
+        Args:
+            frame (cv2.typing.MatLike): BGR or grayscale frame
+            gray (cv2.typing.MatLike, optional): Grayscale version, used when given. Defaults to None.
+
+        Returns:
+            float: 0 (black) to 255 (white)
+        """
+        image = gray if gray is not None else frame
+        b, g, r, _ = cv2.mean(image[:: self.stride, :: self.stride])
+        if image.ndim == 2:
+            return b
+        # Same weights as cv2.COLOR_BGR2GRAY, on the subsample only
+        return 0.114 * b + 0.587 * g + 0.299 * r
+
+    def update(
+        self, frame: cv2.typing.MatLike, gray: cv2.typing.MatLike = None
+    ) -> int:
+        """Measure a frame and decide the LED duty
+
+        Args:
+            frame (cv2.typing.MatLike): BGR or grayscale frame
+            gray (cv2.typing.MatLike, optional): Grayscale version from the detector. Defaults to None.
+
+        Returns:
+            int: New duty to send with WebRequester.setLight(), None to keep the current one
+        """
+        now = time.monotonic()
+        if now - self._last < self.period:
+            return None
+        self._last = now
+        measure = self.brightness(frame, gray)
+        if self.level is None:
+            self.level = measure
+        else:
+            self.level += self.smoothing * (measure - self.level)
+
+        duty = self.duty
+        if self.level < self.low:
+            duty = min(duty + self.step, self.maxDuty)
+        elif self.level > self.high:
+            duty = max(duty - self.step, 0)
+        if duty == self.duty:
+            return None
+        self.duty = duty
+        return duty
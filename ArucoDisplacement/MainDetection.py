@@ -3,6 +3,10 @@ import sys
 
 DEBUG_ARUCO = True
 DEBUG_WEB = False and not DEBUG_ARUCO
+REDUCTION = 1  # Decode at 1/REDUCTION scale when nothing is displayed (1, 2, 4 or 8)
+RECORD = None  # Session folder to record the frames to, None to disable
+METRICS_PORT = None  # Local port serving /metrics and /metrics.json, None to disable
+METRICS_FILE = None  # .json or .prom file the metrics are written to at exit, None to disable
 
 
 def install():
@@ -28,36 +32,22 @@ print(abspath(getsourcefile(lambda: 0)))
 # install()
 
 import cv2
-import numpy as np
-import cv2.aruco as aruco
 import time
 
 from ArucoProcess import ArucoProcess
-from WebRequester import WebRequester, ShowRequest
-from Calibration import calibrate
+from WebRequester import WebRequester, ShowRequest, QUALITIES
+from Calibration import intrinsicsFor
+from AdaptiveQuality import AdaptiveQuality
+from Session import SessionRecorder
+from Metrics import METRICS
+from Exposure import ExposureController
 
-SAVED = time.time()
-LED = False
 ELECTRO = False
 
 
-def BrightnessControl(image) -> bool:
-    global SAVED
-    now = time.time()
-    if int(now - SAVED) < 5:
-        return True
-    else:
-        SAVED = now
-    limit = 50
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    mean = np.mean(gray)
-    # print(mean)
-    return mean > limit
-
-
 if __name__ == "__main__":
     def print_usage_message():
-        print("python Main.py (lo|mid|hi) [4|5|6|7] [Big size in mm] [Small size in mm] [ArucoID1=81] [ArucoID2=88]")
+        print("python Main.py (lo|mid|hi|auto) [4|5|6|7] [Big size in mm] [Small size in mm] [ArucoID1=81] [ArucoID2=88]")
 
     def print_invalid_argument_message(argument, valid_values, condition=None):
         message = f"Invalid argument : {argument}. Must be in {valid_values}"
@@ -90,7 +80,7 @@ if __name__ == "__main__":
 
     if len(sys.argv) < 2:
         print_usage_message()
-    elif not check_argument_value(sys.argv[1], ["lo", "mid", "hi"]):
+    elif not check_argument_value(sys.argv[1], QUALITIES + ["auto"]):
         pass
     elif len(sys.argv) >= 3 and not check_argument_value(sys.argv[2], ["4", "5", "6", "7"]):
         pass
@@ -103,40 +93,63 @@ if __name__ == "__main__":
     elif len(sys.argv) >= 7 and not check_non_negative_integer_argument(sys.argv[6]):
         pass
     else:
-        camera_matrix, camera_distortion = calibrate(False)
+        auto = sys.argv[1] == "auto"
+        quality = "lo" if auto else sys.argv[1]
+        camera = intrinsicsFor(quality)
         prev = 999
-        requester: WebRequester = WebRequester(sys.argv[1])
+        display = DEBUG_ARUCO or DEBUG_WEB
+        recorder = SessionRecorder(RECORD) if RECORD else None
+        requester: WebRequester = WebRequester(
+            quality,
+            gray=not display,
+            reduction=1 if display else REDUCTION,
+            recorder=recorder,
+        )
         processor: ArucoProcess = ArucoProcess(
-            matrix=camera_matrix,
-            distortion=camera_distortion,
+            matrix=camera.matrix,
+            distortion=camera.distortion,
             width=requester.width,
             height=requester.height,
             arucoType= int(sys.argv[2]) if len(sys.argv) >= 3 else 6,
             arucoSize1= float(sys.argv[3]) if len(sys.argv) >= 4 else 100,
             arucoSize2= float(sys.argv[4]) if len(sys.argv) >= 5 else 12.5,
             id1 = int(sys.argv[5]) if len(sys.argv) >= 6 else 81,
-            id2 = int(sys.argv[6]) if len(sys.argv) >= 7 else 88
+            id2 = int(sys.argv[6]) if len(sys.argv) >= 7 else 88,
+            pose=False,
         )
+        adaptive = AdaptiveQuality(requester, processor) if auto else None
+        exposure = ExposureController()
+        if METRICS_FILE:
+            METRICS.enable()
+        if METRICS_PORT:
+            METRICS.serve(METRICS_PORT)
+        requester.startCapture()
         while True:
             try:
 
-                img = requester.request()
-
-                # if not BrightnessControl(img) and not LED:
-                #     requester.TurnOnLight()
-                #     LED = True
-                # pass
+                img, stamp, quality = requester.latest()
+                METRICS.tick("detection.loop")
 
                 if DEBUG_WEB:
                     ShowRequest(img)
 
+                if adaptive:
+                    adaptive.prepare(quality)
                 processor.getArucos(img)
+                if adaptive:
+                    adaptive.update()
+
+                # Brightness from the grayscale image of the detection
+                duty = exposure.update(img, processor.detect()[2])
+                if duty is not None:
+                    requester.setLight(duty)
 
                 if DEBUG_ARUCO:
                     processor.showArucos()
 
-                dic = processor.dico.get(processor.id2, processor.dico.get(processor.id1))
-                cx, cy, rotZ, dist = dic if not dic == None else (0, 0, 0, 0)
+                dic = processor.target()
+                cx, cy, rotZ, dist = dic[:4] if not dic == None else (0, 0, 0, 0)
+                METRICS.observe("detection.latency", time.time() - stamp)
                 prev = (cx, cy, rotZ, dist) if dist != 0 else prev
 
                 if processor.id2 in processor.dico and not ELECTRO:
@@ -170,5 +183,14 @@ if __name__ == "__main__":
                         requester.TurnOffLight()
                         break
 
+            except ConnectionError as e:
+                print(e)
+                break
             except KeyboardInterrupt:
                 break
+        requester.close()
+        METRICS.close()
+        if METRICS_FILE:
+            METRICS.dump(METRICS_FILE)
+        if recorder:
+            recorder.close()
@@ -1,24 +1,86 @@
 from pyparrot.Bebop import Bebop
 # from pyparrot.Minidrone import Mambo
 import tkinter as tk
+import queue
+import threading
+import cv2
 from PIL import Image, ImageTk
-import time
 import sys
-import cv2
-import numpy as np
 
 from ArucoProcess import ArucoProcess
 from WebRequester import WebRequester, ShowRequest
-from Calibration import calibrate
+from Calibration import intrinsicsFor
+from AdaptiveQuality import AdaptiveQuality
+from Autoland import AutolandEngine
+from Session import SessionRecorder
+from Metrics import METRICS
+from Exposure import ExposureController
 
-SAVED = time.time()
-LED = False
 ELECTRO = False
 DEBUG = True
+POLL_PERIOD = 1.0  # Seconds between two ArUco status updates, first argument overrides it
+RECORD = None  # Session folder to record frames and commands to, None to disable
+METRICS_PORT = None  # Local port serving /metrics and /metrics.json, None to disable
+METRICS_FILE = None  # .json or .prom file the metrics are written to at exit, None to disable
+
+
+class DetectionWorker(threading.Thread):
+    def __init__(
+        self,
+        requester: WebRequester,
+        processor: ArucoProcess,
+        adaptive: AdaptiveQuality,
+        lock: threading.Lock,
+        period: float,
+    ) -> None:
+        """Thread checking for ArUcos, so the Tk loop never waits on the camera
+
+        Args:
+            requester (WebRequester): Camera requester, its capture thread must be started
+            processor (ArucoProcess): Detector shared with autoland
+            adaptive (AdaptiveQuality): Quality controller of the processor
+            lock (threading.Lock): Held while using the processor
+            period (float): Seconds between two checks
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.requester = requester
+        self.processor = processor
+        self.adaptive = adaptive
+        self.lock = lock
+        self.period = period
+        # Only the newest status matters
+        self.status: queue.Queue[str] = queue.Queue(maxsize=1)
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        while not self._halt.is_set():
+            try:
+                img, _, quality = self.requester.latest(self.period, newer=False)
+                with self.lock:
+                    self.adaptive.prepare(quality)
+                    found = self.processor.arucoDetected(img)
+                txt = "Found" if found else "Not Found"
+            except ConnectionError:
+                txt = "No camera"
+                # Reconnect, the capture thread ended with the error
+                self.requester.startCapture()
+            except TimeoutError:
+                txt = "No camera"
+            try:
+                self.status.get_nowait()
+            except queue.Empty:
+                pass
+            self.status.put(txt)
+            self._halt.wait(self.period)
+
+    def stop(self) -> None:
+        self._halt.set()
+
 
 class Parrot(tk.Frame):
-    def __init__(self, parent):
+    def __init__(self, parent, worker: DetectionWorker):
         tk.Frame.__init__(self, parent, width=500, height=500)
+        self.worker = worker
         self.info = tk.Label(
             self,
             text="Z : Front - S : Back\nQ : Left - D : Right\nA : Rotate Left - E : Rotate Right\nR : Up - F : Down\nEspace : Take Off - Ctrl : Land\nEscape : Panic Button\nL : Auto Land on ceiling",
@@ -55,19 +117,36 @@ class Parrot(tk.Frame):
     #     self.timer.after(1, self.clock)
 
     def detectAruco(self):
-        txt = "Found" if processor.arucoDetected(requester.request()) else "Not Found"
-        self.aruco.config(text=f"Aruco : {txt}")
-        self.aruco.after(1000, self.detectAruco)
+        """Show the newest status of the detection worker, never blocks"""
+        try:
+            txt = self.worker.status.get_nowait()
+        except queue.Empty:
+            pass
+        else:
+            self.aruco.config(text=f"Aruco : {txt}")
+        self.aruco.after(int(self.worker.period * 1000), self.detectAruco)
+
+    def showAutoland(self):
+        """Show the newest autoland debug frame, HighGUI stays on the Tk thread"""
+        if engine is not None:
+            try:
+                frame = engine.display.get_nowait()
+            except queue.Empty:
+                pass
+            else:
+                cv2.imshow("ArUco Detection", frame)
+                cv2.waitKey(1)
+        self.after(30, self.showAutoland)
 
     def on_wasd(self, event):
         # self.label.configure(text="last key pressed: " + event.keysym)
+        if event.keysym != "l":
+            # Manual commands never interleave with the autoland ones
+            stopAutoland()
         match event.keysym:
             case "l":  # L
                 # print("autoland ceiling")
-                try:
-                    autoland()
-                except KeyboardInterrupt:
-                    pass
+                autoland()
                 # TODO
             case "space":  # Space
                 # print("taking off!")
@@ -137,100 +216,70 @@ class Parrot(tk.Frame):
         # print("flying state is %s" % mambo.sensors.flying_state)
         bebop.ask_for_state_update()
 
-def BrightnessControl(image) -> bool:
-    """Check luminosity
-
-    Args:
-        image (Matlike): image to work with
+# Autolanding, on its own thread so the keys (Escape first) keep working
+engine: AutolandEngine = None
 
-    Returns:
-        bool: True if the luminosity is correct, else False
-    """
-    global SAVED
-    now = time.time()
-    if int(now - SAVED) < 5:
-        return True
-    else:
-        SAVED = now
-    limit = 50
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    mean = np.mean(gray)
-    return mean > limit
 
-# Autolanding
 def autoland():
-    prev = 999
-    while True:
-        try :
-            img = requester.request() #Retreive img
-
-            if not BrightnessControl(img) and not LED:
-                requester.TurnOnLight()
-                LED = True
-
-            processor.getArucos(img)
-
-            if DEBUG:
-                processor.showArucos()
-
-            dic = processor.dico.get(processor.id2, processor.dico.get(processor.id1))
-            cx, cy, rotZ, dist = dic if not dic == None else (0, 0, 0, 0)
-            prev = (cx, cy, rotZ, dist) if dist != 0 else prev
-
-            if processor.id2 in processor.dico and not ELECTRO:
-                requester.TurnOnElectro()
-                ELECTRO = True
-
-
-            if abs(rotZ) > 10:
-                print("Rotate Left") if rotZ < 0 else print("Rotate Right")
-                bebop.fly_direct(roll=0, pitch=0, yaw=-strengh_L, vertical_movement=0, duration=time_t) if rotZ < 0 else bebop.fly_direct(roll=0, pitch=0, yaw=strengh_L, vertical_movement=0, duration=time_t)
-                bebop.ask_for_state_update()
-
-            elif abs(cx) > 20 or abs(cy) > 20:
-                if abs(cx) > 20:
-                    print("Left") if cx > 0 else print("Right")
-                    bebop.fly_direct(roll=-strengh_L, pitch=0, yaw=0, vertical_movement=0, duration=time_t) if cx > 0 else bebop.fly_direct(roll=strengh_L, pitch=0, yaw=0, vertical_movement=0, duration=time_t)
-                    bebop.ask_for_state_update()
-                    
-                if abs(cy) > 20:
-                    print("Back") if cy > 0 else print("Front")
-                    bebop.fly_direct(roll=0, pitch=-strengh_L, yaw=0, vertical_movement=0, duration=time_t) if cy > 0 else bebop.fly_direct(roll=0, pitch=strengh_L, yaw=0, vertical_movement=0, duration=time_t)
-                    bebop.ask_for_state_update()
-
-            elif not dic == None :
-                print("Up")
-                bebop.fly_direct(roll=0, pitch=0, yaw=0, vertical_movement=5, duration=time_t)
-                bebop.ask_for_state_update()
+    global engine
+    if engine is not None and engine.running():
+        return
+    engine = AutolandEngine(
+        requester,
+        processor,
+        bebop,
+        adaptive=adaptive,
+        exposure=exposure,
+        strength=strengh_L,
+        duration=time_t,
+        debug=DEBUG,
+        lock=processorLock,
+        recorder=recorder,
+        profiles=("fast-approach", "precise-dock"),
+    )
+    engine.start()
 
-            else:
-                print("Hold")
 
-            # TODO: EXIT CONDITION
-        except KeyboardInterrupt:
-            break
+def stopAutoland():
+    """Stop autoland before any other command, waiting for its last one"""
+    if engine is not None:
+        engine.stop(timeout=5)
 
 
 if __name__ == "__main__":
 
-    camera_matrix, camera_distortion = calibrate(False)
-    
-    requester: WebRequester = WebRequester("mid")
+    recorder = SessionRecorder(RECORD) if RECORD else None
+    requester: WebRequester = WebRequester("lo", gray=not DEBUG, recorder=recorder)
+    camera = intrinsicsFor("lo")
     processor: ArucoProcess = ArucoProcess(
-        camera_matrix,
-        camera_distortion,
-        6,
-        100,
-        requester.width,
-        requester.height,
-        81,
+        matrix=camera.matrix,
+        distortion=camera.distortion,
+        width=requester.width,
+        height=requester.height,
+        arucoType=6,
+        arucoSize1=100,
+        id1=81,
+        tracking=True,
+        pyramid=True,
+        flow=True,
+        pose=False,
+    )
+    adaptive = AdaptiveQuality(requester, processor)
+    exposure = ExposureController()
+    processorLock = threading.Lock()
+    worker = DetectionWorker(
+        requester,
+        processor,
+        adaptive,
+        processorLock,
+        float(sys.argv[1]) if len(sys.argv) > 1 else POLL_PERIOD,
     )
 
     root = tk.Tk()
     time_t = 0.1
     strengh_H = 20
     strengh_L = 10
-    parr = Parrot(root)
+    parr = Parrot(root, worker)
     parr.pack(fill="both", expand=True)
 
     # you will need to change this to the address of YOUR mambo
@@ -251,11 +300,28 @@ if __name__ == "__main__":
             bebop.smart_sleep(2)
 
             # parr.clock()
+            if METRICS_FILE:
+                METRICS.enable()
+            if METRICS_PORT:
+                METRICS.serve(METRICS_PORT)
+            requester.startCapture()
+            worker.start()
             parr.detectAruco()
+            if DEBUG:
+                parr.showAutoland()
             root.mainloop()
 
         except KeyboardInterrupt:
             print("disconnect")
+            stopAutoland()
             bebop.safe_land(2)
             bebop.smart_sleep(2)
             bebop.disconnect()
+    stopAutoland()
+    worker.stop()
+    requester.close()
+    METRICS.close()
+    if METRICS_FILE:
+        METRICS.dump(METRICS_FILE)
+    if recorder:
+        recorder.close()
@@ -0,0 +1,231 @@
+import collections
+import contextlib
+import json
+import re
+import threading
+import time
+import typing as _typing
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUANTILES = (0.5, 0.9, 0.99)
+_NOOP = contextlib.nullcontext()
+
+
+class Histogram:
+    def __init__(self, window: int) -> None:
+        """Rolling window of observations, with lifetime count and sum
+
+        Args:
+            window (int): Observations kept for the quantiles
+        """
+        self.values: collections.deque[float] = collections.deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.values.append(value)
+        self.count += 1
+        self.sum += value
+
+    def summary(self) -> dict:
+        """Statistics of the window
+
+        Returns:
+            dict: count and sum since start, mean, quantiles and max of the window
+        """
+        result = {"count": self.count, "sum": self.sum}
+        if self.values:
+            window = np.fromiter(self.values, dtype=np.float64, count=len(self.values))
+            result["mean"] = float(window.mean())
+            for q, v in zip(QUANTILES, np.quantile(window, QUANTILES)):
+                result[f"p{round(q * 100)}"] = float(v)
+            result["max"] = float(window.max())
+        return result
+
+
+class _Span:
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics: "Metrics", name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self) -> "_Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    def __init__(self, window: int = 1000) -> None:
+        """Timing spans, rolling histograms and counters of the pipeline
+
+        Disabled by default: span() then returns a shared no-op context and
+        observe(), count() and tick() return at once, so instrumented code
+        costs one attribute test per call.
+
+        Args:
+            window (int, optional): Observations kept per histogram. Defaults to 1000.
+        """
+        self.window = window
+        self.enabled = False
+        self.histograms: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self._ticks: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer = None
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self._ticks.clear()
+
+    def span(self, name: str) -> _typing.ContextManager:
+        """Time a block into the histogram name, in seconds
+
+        Args:
+            name (str): Histogram name. e.g: camera.transfer
+
+        Returns:
+            _typing.ContextManager: Context to run the block in
+        """
+        if not self.enabled:
+            return _NOOP
+        return _Span(self, name)
+
+    def observe(self, name: str, value: float) -> None:
+        """Add a value to the histogram name"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(self.window)
+            histogram.observe(value)
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Increase the counter name"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def tick(self, name: str) -> None:
+        """Mark one turn of a loop, its frequency in Hz goes to the histogram name"""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        last = self._ticks.get(name)
+        self._ticks[name] = now
+        if last is not None and now > last:
+            self.observe(name, 1 / (now - last))
+
+    def snapshot(self) -> dict:
+        """Current state, JSON ready
+
+        Returns:
+            dict: histograms summaries and counters by name
+        """
+        with self._lock:
+            return {
+                "time": time.time(),
+                "histograms": {
+                    name: h.summary() for name, h in sorted(self.histograms.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+            }
+
+    def prometheus(self) -> str:
+        """Current state in the Prometheus text format
+
+        Returns:
+            str: Histograms as summaries and counters as *_total
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for name, summary in snapshot["histograms"].items():
+            metric = promName(name)
+            lines.append(f"# TYPE {metric} summary")
+            for q in QUANTILES:
+                value = summary.get(f"p{round(q * 100)}")
+                if value is not None:
+                    lines.append(f'{metric}{{quantile="{q}"}} {value}')
+            lines.append(f"{metric}_sum {summary['sum']}")
+            lines.append(f"{metric}_count {summary['count']}")
+        for name, value in snapshot["counters"].items():
+            metric = promName(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:
+        """Write the current state to a file, Prometheus text if it ends with .prom, else JSON
+
+        Args:
+            path (str): Output file
+        """
+        text = (
+            self.prometheus()
+            if path.endswith(".prom")
+            else json.dumps(self.snapshot(), indent=2)
+        )
+        with open(path, "w") as f:
+            f.write(text)
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> None:
+        """Enable the metrics and expose them on /metrics (Prometheus) and /metrics.json
+
+        Args:
+            port (int): Local port
+            host (str, optional): Address to bind. Defaults to 127.0.0.1.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path == "/metrics":
+                    body, kind = metrics.prometheus(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, kind = json.dumps(metrics.snapshot()), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        self.enable()
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self) -> None:
+        """Stop the endpoint started by serve()"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def promName(name: str) -> str:
+    """Prometheus metric name of a dotted name. e.g: camera.transfer -> camera_transfer"""
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+# Shared by every module of the pipeline
+METRICS = Metrics()
@@ -0,0 +1,252 @@
+import math
+import sys
+import threading
+import time
+import typing as _typing
+import cv2
+import numpy as np
+
+from ArucoProcess import ArucoProcess, ArucoData
+from WebRequester import WebRequester
+from Calibration import intrinsicsFor
+
+
+def rollMatrix(degrees: float) -> np.ndarray:
+    """CameraSpec.rotation of a camera turned around its optical axis
+
+    Args:
+        degrees (float): Roll from the first camera, counterclockwise seen from behind the camera
+
+    Returns:
+        np.ndarray: 3x3 rotation around z
+    """
+    c, s = math.cos(math.radians(degrees)), math.sin(math.radians(degrees))
+    return np.array([[c, -s, 0], [s, c, 0], [0, 0, 1]], dtype=np.float64)
+
+
+class CameraSpec(_typing.NamedTuple):
+    """One camera of a MultiCamera rig"""
+
+    host: str  # host or host:port of the camera
+    name: str = None  # Calibration name, see Calibration.capPrefix(). None for the main camera
+    quality: str = "lo"
+    rotation: np.ndarray = None  # 3x3 from this camera frame to the first camera frame, identity if None
+    offset: np.ndarray = None  # Position of this camera in the first camera frame, in cm, origin if None
+
+
+class CameraWorker(threading.Thread):
+    def __init__(
+        self,
+        spec: CameraSpec,
+        rig: "MultiCamera",
+        processorArgs: dict,
+    ) -> None:
+        """Capture and detection of one camera, on its own thread
+
+        Args:
+            spec (CameraSpec): Camera to run
+            rig (MultiCamera): Rig notified of every processed frame
+            processorArgs (dict): ArucoProcess keyword arguments, besides the camera model
+        """
+        threading.Thread.__init__(self, daemon=True)
+        self.spec = spec
+        self.rig = rig
+        self.requester = WebRequester(spec.quality, host=spec.host)
+        camera = intrinsicsFor(spec.quality, camera=spec.name)
+        self.processor = ArucoProcess(
+            camera.matrix,
+            camera.distortion,
+            *camera.size,
+            **processorArgs,
+        )
+        self.rotation = np.eye(3) if spec.rotation is None else np.asarray(spec.rotation, dtype=np.float64)
+        self.offset = np.zeros(3) if spec.offset is None else np.asarray(spec.offset, dtype=np.float64)
+        self.stamp = 0.0
+        self.dico: dict[int, ArucoData] = {}
+        self.error: Exception = None
+        self._halt = threading.Event()
+
+    def run(self) -> None:
+        self.requester.startCapture()
+        while not self._halt.is_set():
+            try:
+                img, stamp, _ = self.requester.latest(0.5)
+            except TimeoutError:
+                continue
+            except ConnectionError as e:
+                self.error = e
+                break
+            self.processor.getArucos(img)
+            self.rig.publish(self, stamp, dict(self.processor.dico))
+        self.requester.close()
+        self.rig.publish(self, self.stamp, {})
+
+    def stop(self) -> None:
+        self._halt.set()
+
+
+class MultiCamera:
+    def __init__(
+        self,
+        cameras: list[CameraSpec],
+        maxAge: float = 0.5,
+        **processorArgs,
+    ) -> None:
+        """N cameras fetched and processed concurrently, their detections fused in the first camera frame
+
+        Each camera has its own requester, calibration and ArucoProcess on its
+        own thread, so OpenCV runs them on separate cores. The fused ArucoData
+        is expressed as if seen by the first camera: cx and cy are the projection
+        of the fused position on its frame, even when only another camera sees
+        the marker, so the autoland decisions keep working while it is out of view.
+
+        Args:
+            cameras (list[CameraSpec]): Cameras, the first one is the reference
+            maxAge (float, optional): Oldest detection, in seconds, taken in the fusion. Defaults to 0.5.
+            **processorArgs: ArucoProcess keyword arguments (arucoType, sizes, ids)
+        """
+        self.maxAge = maxAge
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._taken = 0
+        self.workers = [CameraWorker(spec, self, processorArgs) for spec in cameras]
+        reference = self.workers[0].processor
+        self.id1 = reference.id1
+        self.id2 = reference.id2
+        self.dico: dict[int, ArucoData] = {}
+
+    def start(self) -> None:
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self) -> None:
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join()
+
+    def publish(self, worker: CameraWorker, stamp: float, dico: dict[int, ArucoData]) -> None:
+        """Called by the workers with each processed frame"""
+        with self._cond:
+            worker.stamp = stamp
+            worker.dico = dico
+            self._seq += 1
+            self._cond.notify_all()
+
+    def wait(self, timeout: float = None) -> None:
+        """Wait until a camera processed a frame not fused yet
+
+        Args:
+            timeout (float, optional): Max wait in seconds. Defaults to None (forever).
+
+        Raises:
+            ConnectionError: every camera was lost
+            TimeoutError: no camera processed a frame in time
+        """
+        with self._cond:
+            ready = self._cond.wait_for(lambda: self._seq > self._taken, timeout)
+            if all(worker.error is not None for worker in self.workers):
+                raise ConnectionError("Every camera of the rig was lost")
+            if not ready:
+                raise TimeoutError("No frame processed by the cameras")
+            self._taken = self._seq
+
+    def fuse(self) -> dict[int, ArucoData]:
+        """Fuse the fresh detections of every camera into self.dico
+
+        Positions are moved to the first camera frame and averaged with a
+        weight of 1 / size^2, size being the cm per pixel ratio: the camera
+        seeing the marker the biggest counts the most.
+
+        Returns:
+            dict[int, ArucoData]: Fused entries by ArUco ID, in the first camera frame
+        """
+        now = time.time()
+        with self._cond:
+            views = [
+                (worker, worker.dico)
+                for worker in self.workers
+                if worker.dico and now - worker.stamp <= self.maxAge
+            ]
+        reference = self.workers[0].processor
+        self.dico = {}
+        for arID in (self.id1, self.id2):
+            seen = [
+                (worker, dico[arID])
+                for worker, dico in views
+                if arID in dico and dico[arID].tvec is not None
+            ]
+            if not seen:
+                continue
+            weights = np.array([1 / data.size**2 for _, data in seen])
+            weights /= weights.sum()
+            positions = np.array(
+                [worker.rotation @ data.tvec + worker.offset for worker, data in seen]
+            )
+            position = weights @ positions
+            # Yaw is circular, average the unit vectors. A camera rolled by theta
+            # from the reference sees the reference yaw plus theta
+            yaws = np.radians(
+                [
+                    data.rotZ - math.degrees(math.atan2(worker.rotation[1, 0], worker.rotation[0, 0]))
+                    for worker, data in seen
+                ]
+            )
+            yaw = math.degrees(
+                math.atan2(weights @ np.sin(yaws), weights @ np.cos(yaws))
+            )
+
+            best, data = seen[int(np.argmax(weights))]
+            rvec = cv2.Rodrigues(best.rotation @ cv2.Rodrigues(data.rvec)[0])[0].ravel()
+
+            # As the first camera would see it
+            fx, fy = reference.matrix[0][0], reference.matrix[1][1]
+            u = fx * position[0] / position[2] + reference.matrix[0][2]
+            v = fy * position[1] / position[2] + reference.matrix[1][2]
+            self.dico[arID] = ArucoData(
+                u - reference.width // 2,
+                -(v - reference.height // 2),
+                yaw,
+                # 20 * side / perimeter, the perimeter being 4 * side * fx / z
+                5 * position[2] / fx,
+                position,
+                rvec,
+                None,
+            )
+        return self.dico
+
+    def target(self) -> ArucoData:
+        """Fused data of the ArUco to follow: the small one when visible, else the big one
+
+        Returns:
+            ArucoData: Entry of self.dico, None if no camera sees either
+        """
+        return self.dico.get(self.id2, self.dico.get(self.id1))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("python MultiCamera.py host[=calibration name][@roll] [host[=calibration name][@roll] ...]")
+        print("Cameras are assumed side by side and looking the same way,")
+        print("roll being the angle in degrees around the optical axis from the first camera")
+    else:
+        specs = []
+        for arg in sys.argv[1:]:
+            arg, _, roll = arg.partition("@")
+            host, _, name = arg.partition("=")
+            specs.append(CameraSpec(host, name or None, rotation=rollMatrix(float(roll or 0))))
+        rig = MultiCamera(specs)
+        rig.start()
+        try:
+            while True:
+                rig.wait()
+                rig.fuse()
+                target = rig.target()
+                print(
+                    {arID: tuple(round(float(v), 1) for v in data[:4]) for arID, data in rig.dico.items()}
+                    if target is not None
+                    else "Hold"
+                )
+        except (ConnectionError, KeyboardInterrupt) as e:
+            print(e)
+        rig.stop()
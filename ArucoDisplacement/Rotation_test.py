@@ -13,6 +13,8 @@ arucoSize = 140  # mm
 arucoDict = aruco.getPredefinedDictionary(arucoType)
 arucoParams = aruco.DetectorParameters()
 
+mtx, dist = calibrate(False)
+
 images = glob.glob("**/test*.jpg", recursive=True)
 print(images)
 i=0
@@ -26,8 +28,6 @@ for frame in images:
     cv2.imshow("test Rotation", display)
     cv2.waitKey(0)
 
-    mtx, dist = calibrate(False)
-
     rvec, tvec, markerPoints = cv2.aruco.estimatePoseSingleMarkers(
         corners[0], 0.02, mtx, dist
     )
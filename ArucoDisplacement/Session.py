@@ -0,0 +1,363 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+
+from WebRequester import WebRequester, QUALITIES, decodeFlag, sizePicker
+
+DATA_FILE = "frames.bin"
+INDEX_FILE = "index.bin"
+
+# Index record: kind, quality, time.time() stamp, offset and length in DATA_FILE
+RECORD = struct.Struct("<BBdQI")
+RECORD_DTYPE = np.dtype(
+    [
+        ("kind", "u1"),
+        ("quality", "u1"),
+        ("stamp", "<f8"),
+        ("offset", "<u8"),
+        ("length", "<u4"),
+    ]
+)
+FRAME = 0
+COMMAND = 1
+
+
+class SessionEnded(ConnectionError):
+    """The replayed session has no frame left, like a camera that went away"""
+
+
+class SessionRecorder:
+    def __init__(self, folder: str) -> None:
+        """Append camera frames and sent commands to a session folder
+
+        Payloads go to DATA_FILE and one fixed size RECORD per payload to
+        INDEX_FILE, written after its payload so a crash never leaves an index
+        entry pointing past the data. Recording again in the same folder appends.
+
+        Args:
+            folder (str): Session folder, created if needed
+        """
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self._data = open(os.path.join(folder, DATA_FILE), "ab")
+        self._index = open(os.path.join(folder, INDEX_FILE), "ab")
+        self._offset = self._data.tell()
+        self._lock = threading.Lock()
+
+    def _append(self, kind: int, quality: int, stamp: float, payload: bytes) -> None:
+        with self._lock:
+            self._data.write(payload)
+            self._data.flush()
+            self._index.write(
+                RECORD.pack(kind, quality, stamp, self._offset, len(payload))
+            )
+            self._index.flush()
+            self._offset += len(payload)
+
+    def frame(self, data: bytes, stamp: float, quality: str) -> None:
+        """Record a JPEG as received from the camera
+
+        Args:
+            data (bytes): JPEG data
+            stamp (float): Reception time (time.time())
+            quality (str): lo, mid or hi
+        """
+        self._append(FRAME, QUALITIES.index(quality), stamp, data)
+
+    def command(self, name: str, **kwargs) -> None:
+        """Record a command sent to the drone or the camera board
+
+        Args:
+            name (str): Command name. e.g: fly_direct, led, electro
+            **kwargs: Command arguments, JSON serializable
+        """
+        payload = json.dumps({"name": name, "args": kwargs}).encode()
+        self._append(COMMAND, 0, time.time(), payload)
+
+    def close(self) -> None:
+        with self._lock:
+            self._data.close()
+            self._index.close()
+
+
+class SessionReplay:
+    def __init__(
+        self,
+        folder: str,
+        realtime: bool = True,
+        gray: bool = False,
+        reduction: int = 1,
+    ) -> None:
+        """Read a recorded session back, in place of a WebRequester
+
+        Both files are memory-mapped: frames are decoded straight from the
+        mapping, without being read into Python bytes first.
+
+        Args:
+            folder (str): Session folder written by SessionRecorder
+            realtime (bool, optional): Deliver frames at their recorded pace, else as fast as they are asked for. Defaults to True.
+            gray (bool, optional): Decode frames to grayscale. Defaults to False.
+            reduction (int, optional): Decode at 1/reduction scale, one of 1, 2, 4 or 8. Defaults to 1.
+
+        Raises:
+            FileNotFoundError: the folder holds no recorded frame
+        """
+        self.folder = folder
+        self.realtime = realtime
+        self._files = []
+        self._maps = []
+        self.records: np.ndarray = None
+        data = self._map(os.path.join(folder, DATA_FILE))
+        index = self._map(os.path.join(folder, INDEX_FILE))
+        if data is None or index is None:
+            self.close()
+            raise FileNotFoundError(f"No recorded frame in {folder}")
+        # A record cut by a crash is ignored
+        count = len(index) // RECORD.size
+        self.records = np.frombuffer(index, dtype=RECORD_DTYPE, count=count)
+        self._frames = np.flatnonzero(self.records["kind"] == FRAME)
+        if len(self._frames) == 0:
+            self.close()
+            raise FileNotFoundError(f"No recorded frame in {folder}")
+        self._data = data
+
+        first = self.records[self._frames[0]]
+        self.setQuality(QUALITIES[first["quality"]])
+        self.frameQuality = self.quality
+        self.setDecode(gray, reduction)
+        self.dropped = 0
+        self._next = 0
+        self._current: tuple[cv2.typing.MatLike, float, str] = None
+        self._origin: float = None
+
+    def _map(self, path: str) -> mmap.mmap:
+        f = open(path, "rb")
+        self._files.append(f)
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mapped)
+        return mapped
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def setQuality(self, quality: str) -> None:
+        """Accepted for WebRequester compatibility, frames keep their recorded quality
+
+        Args:
+            quality (str): lo, mid or hi
+        """
+        self.size = sizePicker(quality)
+        self.width = self.size[0]
+        self.height = self.size[1]
+        self.quality = quality
+
+    def setDecode(self, gray: bool, reduction: int = 1) -> None:
+        """Choose how the next frames are decoded, as WebRequester.setDecode()
+
+        Raises:
+            ValueError: unsupported reduction
+        """
+        self.decodeFlag = decodeFlag(gray, reduction)
+        self.gray = gray
+        self.reduction = reduction
+
+    def jpeg(self, frame: int) -> np.ndarray:
+        """JPEG data of a recorded frame, without copy
+
+        Args:
+            frame (int): Frame number, from 0 to len(self) - 1
+
+        Returns:
+            np.ndarray: uint8 view on the mapped data
+        """
+        record = self.records[self._frames[frame]]
+        return np.frombuffer(
+            self._data,
+            dtype=np.uint8,
+            count=int(record["length"]),
+            offset=int(record["offset"]),
+        )
+
+    def frameQualityOf(self, frame: int) -> str:
+        return QUALITIES[self.records[self._frames[frame]]["quality"]]
+
+    def stampOf(self, frame: int) -> float:
+        """Recorded reception time (time.time()) of a frame"""
+        return float(self.records["stamp"][self._frames[frame]])
+
+    def commands(self) -> list[tuple[float, str, dict]]:
+        """Commands sent during the session
+
+        Returns:
+            list[tuple[float, str, dict]]: Stamp, name and arguments of each command
+        """
+        result = []
+        for record in self.records[self.records["kind"] == COMMAND]:
+            start = int(record["offset"])
+            payload = json.loads(self._data[start : start + int(record["length"])])
+            result.append((float(record["stamp"]), payload["name"], payload["args"]))
+        return result
+
+    def _deliver(self, frame: int) -> tuple[cv2.typing.MatLike, float, str]:
+        stamp = self.stampOf(frame)
+        if self._origin is None:
+            self._origin = time.time() - stamp
+        self.frameQuality = self.frameQualityOf(frame)
+        img = cv2.imdecode(self.jpeg(frame), self.decodeFlag)
+        self._next = frame + 1
+        # Capture time moved to the replay clock, so frame ages stay meaningful
+        if self.realtime:
+            self._current = img, stamp + self._origin, self.frameQuality
+        else:
+            self._current = img, time.time(), self.frameQuality
+        return self._current
+
+    def _due(self) -> int:
+        # Newest frame whose recorded time has come, waiting for the next one if none
+        if self._next >= len(self._frames):
+            raise SessionEnded(f"End of the session recorded in {self.folder}")
+        if not self.realtime or self._origin is None:
+            return self._next
+        stamps = self.records["stamp"][self._frames]
+        now = time.time() - self._origin
+        wait = stamps[self._next] - now
+        if wait > 0:
+            time.sleep(wait)
+            return self._next
+        frame = int(np.searchsorted(stamps, now, side="right")) - 1
+        return max(frame, self._next)
+
+    def request(self) -> cv2.typing.MatLike:
+        """Next recorded frame, as WebRequester.request()
+
+        Raises:
+            SessionEnded: every frame was delivered
+
+        Returns:
+            cv2.typing.MatLike: Decoded frame
+        """
+        return self._deliver(self._due())[0]
+
+    def latest(
+        self, timeout: float = None, newer: bool = True
+    ) -> tuple[cv2.typing.MatLike, float, str]:
+        """Newest due frame, as WebRequester.latest(). In real time, late frames are skipped
+
+        Args:
+            timeout (float, optional): Ignored, recorded frames never time out. Defaults to None.
+            newer (bool, optional): False returns the last delivered frame again. Defaults to True.
+
+        Raises:
+            SessionEnded: every frame was delivered
+
+        Returns:
+            tuple[cv2.typing.MatLike, float, str]: Frame, its capture time on the replay clock and its quality
+        """
+        if not newer and self._current is not None:
+            return self._current
+        frame = self._due()
+        self.dropped += frame - self._next
+        return self._deliver(frame)
+
+    def startCapture(self, streaming: bool = False) -> None:
+        pass
+
+    def stopCapture(self) -> None:
+        pass
+
+    def setLight(self, duty: int) -> None:
+        pass
+
+    def TurnOnLight(self):
+        pass
+
+    def TurnOffLight(self):
+        pass
+
+    def TurnOnElectro(self):
+        pass
+
+    def TurnOffElectro(self):
+        pass
+
+    def close(self) -> None:
+        """Release the mappings, frames already returned stay valid"""
+        if self.records is not None:
+            self.records = self.records.copy()
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                # A jpeg() view is still alive, the mapping goes with it
+                pass
+        for f in self._files:
+            f.close()
+        self._maps = []
+        self._files = []
+
+
+def record(folder: str, quality: str, streaming: bool) -> None:
+    """Record the camera frames until Ctrl+C
+
+    Args:
+        folder (str): Session folder
+        quality (str): lo, mid or hi
+        streaming (bool): Read the MJPEG stream instead of polling stills
+    """
+    recorder = SessionRecorder(folder)
+    requester = WebRequester(quality, recorder=recorder)
+    requester.startCapture(streaming)
+    count = 0
+    try:
+        while True:
+            requester.latest()
+            count += 1
+            print(f"\r{count} frames, {requester.dropped} dropped", end="")
+    except (ConnectionError, KeyboardInterrupt) as e:
+        print(f"\n{e}" if isinstance(e, ConnectionError) else "")
+    requester.close()
+    recorder.close()
+
+
+def play(folder: str, realtime: bool) -> None:
+    """Show a recorded session, q to quit
+
+    Args:
+        folder (str): Session folder
+        realtime (bool): Recorded pace, else as fast as possible
+    """
+    replay = SessionReplay(folder, realtime)
+    print(f"{len(replay)} frames, {len(replay.commands())} commands")
+    try:
+        while True:
+            img, _, _ = replay.latest()
+            cv2.imshow("Session", img)
+            if cv2.waitKey(1) == ord("q"):
+                break
+    except SessionEnded:
+        pass
+    print(f"{replay.dropped} frames skipped")
+    replay.close()
+    cv2.destroyAllWindows()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == "record":
+        record(
+            sys.argv[2],
+            sys.argv[3] if len(sys.argv) >= 4 else "lo",
+            len(sys.argv) >= 5 and sys.argv[4] == "stream",
+        )
+    elif len(sys.argv) >= 3 and sys.argv[1] == "play":
+        play(sys.argv[2], not (len(sys.argv) >= 4 and sys.argv[3] == "fast"))
+    else:
+        print("python Session.py record <folder> [lo|mid|hi] [stream]")
+        print("python Session.py play <folder> [fast]")
@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import random
+import time
+import cv2
+import numpy as np
+
+from ArucoProcess import ArucoProcess, PROFILES
+from Benchmark import folderFrames, sessionFrames
+from Calibration import intrinsicsFor
+from Session import INDEX_FILE
+from WebRequester import QUALITIES
+
+# Values tried for each DetectorParameters attribute
+SPACE = {
+    "adaptiveThreshWinSizeMin": [3, 5, 7, 13],
+    "adaptiveThreshWinSizeMax": [13, 17, 23, 33],
+    "adaptiveThreshWinSizeStep": [4, 10, 20],
+    "minMarkerPerimeterRate": [0.01, 0.02, 0.03, 0.05],
+    "polygonalApproxAccuracyRate": [0.03, 0.05, 0.08],
+    "perspectiveRemovePixelPerCell": [2, 4, 8],
+    "useAruco3Detection": [False, True],
+}
+
+# Exhaustive settings whose detections are taken as ground truth
+REFERENCE = {
+    "adaptiveThreshWinSizeMin": 3,
+    "adaptiveThreshWinSizeMax": 53,
+    "adaptiveThreshWinSizeStep": 4,
+    "minMarkerPerimeterRate": 0.01,
+}
+
+
+def sample(rng: random.Random) -> dict:
+    """Random point of SPACE, with a window range that holds at least one pass"""
+    params = {name: rng.choice(values) for name, values in SPACE.items()}
+    if params["adaptiveThreshWinSizeMax"] < params["adaptiveThreshWinSizeMin"]:
+        params["adaptiveThreshWinSizeMax"] = params["adaptiveThreshWinSizeMin"]
+    return params
+
+
+def evaluate(
+    processor: ArucoProcess,
+    profile,
+    frames: list[cv2.typing.MatLike],
+    truth: list[set[int]],
+    repeat: int,
+) -> dict:
+    """Detection time and recall of a profile
+
+    Args:
+        processor (ArucoProcess): Processor whose profile is switched
+        profile (str | dict): Profile to evaluate
+        frames (list[cv2.typing.MatLike]): Grayscale frames
+        truth (list[set[int]]): Searched ids present in each frame
+        repeat (int): Timed passes over the frames
+
+    Returns:
+        dict: profile, median ms per frame, recall and false detections
+    """
+    processor.setProfile(profile)
+    times = []
+    found = 0
+    false = 0
+    for _ in range(repeat):
+        for gray, expected in zip(frames, truth):
+            start = time.perf_counter()
+            _, ids, _ = processor.detect(gray, force=True)
+            times.append(time.perf_counter() - start)
+            seen = set() if ids is None else {int(i) for i in ids.ravel()}
+            seen &= {processor.id1, processor.id2}
+            found += len(seen & expected)
+            false += len(seen - expected)
+    total = sum(len(expected) for expected in truth) * repeat
+    return {
+        "profile": profile,
+        "ms": float(np.median(times) * 1000),
+        "recall": found / total if total else 1.0,
+        "false": false // repeat,
+    }
+
+
+def pareto(results: list[dict]) -> list[dict]:
+    """Results no other one beats on both time and recall
+
+    Args:
+        results (list[dict]): evaluate() results
+
+    Returns:
+        list[dict]: Pareto front, fastest first
+    """
+    front = []
+    best = -1.0
+    for result in sorted(results, key=lambda r: (r["ms"], -r["recall"])):
+        if result["recall"] > best:
+            front.append(result)
+            best = result["recall"]
+    return front
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Search DetectorParameters over recorded frames, report the time/recall Pareto front"
+    )
+    parser.add_argument(
+        "source",
+        nargs="?",
+        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "Images"),
+        help="Folder of .jpg frames or recorded session",
+    )
+    parser.add_argument("--quality", default="lo", choices=QUALITIES)
+    parser.add_argument("--aruco-type", type=int, default=6, choices=[4, 5, 6, 7])
+    parser.add_argument("--id1", type=int, default=81)
+    parser.add_argument("--id2", type=int, default=88)
+    parser.add_argument("--trials", type=int, default=60)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file of every result")
+    args = parser.parse_args()
+
+    if os.path.exists(os.path.join(args.source, INDEX_FILE)):
+        jpegs = sessionFrames(args.source, [args.quality]).get(args.quality, [])
+    else:
+        jpegs = folderFrames(args.source, [args.quality])[args.quality]
+    frames = [
+        cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        for data in jpegs
+    ]
+    camera = intrinsicsFor(args.quality)
+    processor = ArucoProcess(
+        camera.matrix,
+        camera.distortion,
+        *camera.size,
+        arucoType=args.aruco_type,
+        id1=args.id1,
+        id2=args.id2,
+    )
+
+    processor.setProfile(REFERENCE)
+    truth = []
+    for gray in frames:
+        _, ids, _ = processor.detect(gray, force=True)
+        seen = set() if ids is None else {int(i) for i in ids.ravel()}
+        truth.append(seen & {args.id1, args.id2})
+    print(f"{len(frames)} frames, {sum(map(len, truth))} reference detections")
+
+    rng = random.Random(args.seed)
+    candidates = list(PROFILES) + [sample(rng) for _ in range(args.trials)]
+    results = [
+        evaluate(processor, profile, frames, truth, args.repeat)
+        for profile in candidates
+    ]
+
+    for result in pareto(results):
+        print(f"{result['ms']:8.2f} ms  recall {result['recall']:.3f}  false {result['false']}  {result['profile']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"results": results, "pareto": pareto(results)}, f, indent=2)
@@ -1,31 +1,107 @@
+import typing as _typing
 import cv2
 import cv2.typing
-import urllib.request
+import http.client
+import os
+import threading
+import time
+import sys
 import numpy as np
 from enum import Enum
+from urllib.parse import urlsplit
+
+from Metrics import METRICS
 
 DEBUG_CV2 = True
 
-IP = "192.168.168.235" #TODO Change if needed
+# Camera address, host[:port]. CAM_HOST and CAM_STREAM_PORT override them, e.g. for CamEmulator.py
+IP = os.environ.get("CAM_HOST", "192.168.168.235")  # TODO Change if needed
+STREAM_PORT = int(os.environ.get("CAM_STREAM_PORT", 81))
+
 
 class URLTYPE(Enum):
-    URL_LO = f"http://{IP}/lo.jpg"
-    URL_MID = f"http://{IP}/mid.jpg"
-    URL_HI = f"http://{IP}/hi.jpg"
-    URL_LIGHT = f"http://{IP}/led"
-    URL_LIGHT_ON = f"http://{IP}/led/on"
-    URL_LIGHT_OFF = f"http://{IP}/led/off"
-    URL_ELECTRO_ON = f"http://{IP}/electro/on"
-    URL_ELECTRO_OFF = f"http://{IP}/electro/off"
+    URL_LO = "/lo.jpg"
+    URL_MID = "/mid.jpg"
+    URL_HI = "/hi.jpg"
+    URL_LIGHT = "/led"
+    URL_LIGHT_ON = "/led/on"
+    URL_LIGHT_OFF = "/led/off"
+    URL_ELECTRO_ON = "/electro/on"
+    URL_ELECTRO_OFF = "/electro/off"
+    URL_STREAM_LO = "/lo.mjpeg"
+    URL_STREAM_MID = "/mid.mjpeg"
+    URL_STREAM_HI = "/hi.mjpeg"
+
+
+def baseUrl(host: str = None, port: int = None) -> str:
+    """Root url of a camera
+
+    Args:
+        host (str, optional): host or host:port. Defaults to IP.
+        port (int, optional): Port replacing the one of host. Defaults to None.
+
+    Returns:
+        str: e.g. http://192.168.168.235
+    """
+    host = host or IP
+    if port is not None:
+        host = f"{host.split(':')[0]}:{port}"
+    return f"http://{host}"
+
+
+def urlPicker(quality: str, host: str = None) -> str:
+    if quality == "lo":
+        return baseUrl(host) + URLTYPE.URL_LO.value
+    if quality == "mid":
+        return baseUrl(host) + URLTYPE.URL_MID.value
+    if quality == "hi":
+        return baseUrl(host) + URLTYPE.URL_HI.value
 
 
-def urlPicker(quality: str) -> str:
+def streamUrlPicker(quality: str, host: str = None, port: int = None) -> str:
+    base = baseUrl(host, port or STREAM_PORT)
     if quality == "lo":
-        return URLTYPE.URL_LO.value
+        return base + URLTYPE.URL_STREAM_LO.value
     if quality == "mid":
-        return URLTYPE.URL_MID.value
+        return base + URLTYPE.URL_STREAM_MID.value
     if quality == "hi":
-        return URLTYPE.URL_HI.value
+        return base + URLTYPE.URL_STREAM_HI.value
+
+
+# imdecode flags by (grayscale, reduction factor). JPEG decoding at a reduced
+# scale skips most of the IDCT work instead of resizing afterwards
+DECODE_FLAGS = {
+    (False, 1): cv2.IMREAD_COLOR,
+    (False, 2): cv2.IMREAD_REDUCED_COLOR_2,
+    (False, 4): cv2.IMREAD_REDUCED_COLOR_4,
+    (False, 8): cv2.IMREAD_REDUCED_COLOR_8,
+    (True, 1): cv2.IMREAD_GRAYSCALE,
+    (True, 2): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (True, 4): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (True, 8): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def decodeFlag(gray: bool, reduction: int = 1) -> int:
+    """imdecode flag of a decoding mode
+
+    Args:
+        gray (bool): Decode to grayscale instead of BGR
+        reduction (int, optional): Decode at 1/reduction scale, one of 1, 2, 4 or 8. Defaults to 1.
+
+    Raises:
+        ValueError: unsupported reduction
+
+    Returns:
+        int: Entry of DECODE_FLAGS
+    """
+    if (gray, reduction) not in DECODE_FLAGS:
+        raise ValueError(f"Reduction must be 1, 2, 4 or 8, not {reduction}")
+    return DECODE_FLAGS[(gray, reduction)]
+
+
+# Frame qualities of the camera firmware, smallest first
+QUALITIES = ["lo", "mid", "hi"]
 
 
 def sizePicker(quality: str) -> tuple[int, int]:
@@ -37,44 +113,545 @@ def sizePicker(quality: str) -> tuple[int, int]:
         return (1280, 720)
 
 
+class HttpSession:
+    def __init__(
+        self,
+        timeout: float = 2.0,
+        retries: int = 3,
+        backoff: float = 0.2,
+        maxBackoff: float = 2.0,
+        poolSize: int = 2,
+    ) -> None:
+        """Pool of keep-alive HTTP connections shared by every camera request
+
+        Args:
+            timeout (float, optional): Socket timeout in seconds. Defaults to 2.0.
+            retries (int, optional): Attempts after the first failure. Defaults to 3.
+            backoff (float, optional): First wait before reconnecting, in seconds. Defaults to 0.2.
+            maxBackoff (float, optional): Upper bound of the doubling wait. Defaults to 2.0.
+            poolSize (int, optional): Idle connections kept per host. Defaults to 2.
+        """
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.poolSize = poolSize
+        self._pool: dict[str, list[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    def _acquire(self, netloc: str) -> tuple[http.client.HTTPConnection, bool]:
+        with self._lock:
+            idle = self._pool.get(netloc)
+            if idle:
+                return idle.pop(), True
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _release(self, netloc: str, conn: http.client.HTTPConnection) -> None:
+        with self._lock:
+            idle = self._pool.setdefault(netloc, [])
+            if len(idle) < self.poolSize:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def get(self, url: str, halt: threading.Event = None) -> bytes:
+        """GET an url, reusing an open socket when the server allows it
+
+        Args:
+            url (str): Full url to fetch
+            halt (threading.Event, optional): Gives up the retries once set. Defaults to None.
+
+        Raises:
+            ConnectionError: the camera did not answer after every retry
+
+        Returns:
+            bytes: Response body
+        """
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        delay = self.backoff
+        error = None
+        attempt = 0
+        while attempt <= self.retries:
+            conn, reused = self._acquire(parts.netloc)
+            try:
+                if conn.sock is None:
+                    with METRICS.span("camera.connect"):
+                        conn.connect()
+                with METRICS.span("camera.transfer"):
+                    conn.request("GET", path)
+                    resp = conn.getresponse()
+                    data = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                error = e
+                if reused:
+                    # The server dropped an idle socket, retry at once on a new one
+                    continue
+            else:
+                if resp.will_close:
+                    conn.close()
+                else:
+                    self._release(parts.netloc, conn)
+                if resp.status == 200:
+                    return data
+                error = ConnectionError(f"HTTP {resp.status} from {url}")
+            attempt += 1
+            METRICS.count("camera.errors")
+            if attempt <= self.retries:
+                if halt is None:
+                    time.sleep(delay)
+                elif halt.wait(delay):
+                    break
+                delay = min(delay * 2, self.maxBackoff)
+        raise ConnectionError(f"Failed to reach the IP camera at {url}") from error
+
+    def close(self) -> None:
+        """Close every idle connection"""
+        with self._lock:
+            for idle in self._pool.values():
+                for conn in idle:
+                    conn.close()
+            self._pool.clear()
+
+
+class MjpegParser:
+    def __init__(self, boundary: bytes) -> None:
+        """Incremental parser of a multipart/x-mixed-replace body
+
+        Args:
+            boundary (bytes): Boundary announced in the response Content-Type
+        """
+        self.delimiter = b"--" + boundary
+        self._buffer = bytearray()
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        """Add received bytes
+
+        Args:
+            chunk (bytes): Bytes read from the connection
+
+        Returns:
+            list[bytes]: Every JPEG completed by this chunk
+        """
+        self._buffer += chunk
+        parts = []
+        part = self._next()
+        while part is not None:
+            parts.append(part)
+            part = self._next()
+        return parts
+
+    def _next(self) -> bytes:
+        buf = self._buffer
+        # Skip blank lines and the delimiter line before the part headers
+        start = 0
+        while True:
+            if buf.startswith(b"\r\n", start):
+                start += 2
+            elif buf.startswith(self.delimiter, start):
+                eol = buf.find(b"\r\n", start)
+                if eol < 0:
+                    return None
+                start = eol + 2
+            else:
+                break
+        end = buf.find(b"\r\n\r\n", start)
+        if end < 0:
+            return None
+        length = None
+        for line in bytes(buf[start:end]).split(b"\r\n"):
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value)
+        body = end + 4
+        if length is not None:
+            stop = body + length
+            if len(buf) < stop:
+                return None
+        else:
+            # No length given, the part ends at the next delimiter
+            stop = buf.find(b"\r\n" + self.delimiter, body)
+            if stop < 0:
+                return None
+        data = bytes(buf[body:stop])
+        del buf[:stop]
+        return data
+
+
+def boundaryOf(contentType: str) -> bytes:
+    """Extract the multipart boundary from a Content-Type header
+
+    Args:
+        contentType (str): Header value. e.g: multipart/x-mixed-replace;boundary=frame
+
+    Raises:
+        ConnectionError: the header announces no multipart boundary
+
+    Returns:
+        bytes: Boundary without the leading dashes
+    """
+    for param in contentType.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "boundary":
+            return value.strip('"').encode("latin-1")
+    raise ConnectionError(f"Not a multipart stream : {contentType}")
+
+
 class WebRequester:
-    def __init__(self, quality: str) -> None:
-        self.url = urlPicker(quality)
+    def __init__(
+        self,
+        quality: str,
+        timeout: float = 2.0,
+        retries: int = 3,
+        session: HttpSession = None,
+        gray: bool = False,
+        reduction: int = 1,
+        recorder=None,
+        host: str = None,
+        streamPort: int = None,
+    ) -> None:
+        """Init WebRequester class
+
+        Args:
+            quality (str): Frame quality, one of lo, mid or hi
+            timeout (float, optional): Socket timeout in seconds. Defaults to 2.0.
+            retries (int, optional): Reconnections before giving up. Defaults to 3.
+            session (HttpSession, optional): Session to share with other requesters. Defaults to a new one.
+            gray (bool, optional): Decode frames to grayscale, enough for detection without HUD. Defaults to False.
+            reduction (int, optional): Decode at 1/reduction scale, one of 1, 2, 4 or 8. Defaults to 1.
+            recorder (SessionRecorder, optional): Records every received JPEG and camera command. Defaults to None.
+            host (str, optional): Camera host or host:port. Defaults to IP.
+            streamPort (int, optional): Port of the MJPEG streams. Defaults to STREAM_PORT.
+        """
+        self.host = host or IP
+        self.streamPort = streamPort or STREAM_PORT
+        self.setQuality(quality)
+        self.frameQuality = quality
+        self.session = (
+            session if session is not None else HttpSession(timeout, retries)
+        )
+        self.setDecode(gray, reduction)
+        self.recorder = recorder
+        self.dropped = 0
+        self._thread: threading.Thread = None
+        self._halt = threading.Event()
+        self._cond = threading.Condition()
+        self._frame: cv2.typing.MatLike = None
+        self._stamp = 0.0
+        self._frameQuality = quality
+        self._seq = 0
+        self._taken = 0
+        self._error: Exception = None
+
+    def setQuality(self, quality: str) -> None:
+        """Switch the frame quality, a running capture follows from its next frame
+
+        Args:
+            quality (str): lo, mid or hi
+        """
+        self.url = urlPicker(quality, self.host)
+        self.streamUrl = streamUrlPicker(quality, self.host, self.streamPort)
         self.size = sizePicker(quality)
         self.width = self.size[0]
         self.height = self.size[1]
+        self.quality = quality
 
-    def request(self) -> cv2.typing.MatLike:
-        # Create a VideoCapture object & check if the IP camera stream is opened successfully
-        cap = cv2.VideoCapture(self.url)
-        if not cap.isOpened():
-            print("Failed to open the IP camera stream")
-            exit()
+    def fetch(
+        self, quality: str = None, halt: threading.Event = None
+    ) -> tuple[bytes, float]:
+        """Download one JPEG through the shared keep-alive session
+
+        Args:
+            quality (str, optional): lo, mid or hi. Defaults to self.quality.
+            halt (threading.Event, optional): Gives up the retries once set. Defaults to None.
+
+        Returns:
+            tuple[bytes, float]: JPEG data and its reception time (time.time())
+        """
+        quality = quality or self.quality
+        data = self.session.get(urlPicker(quality, self.host), halt)
+        stamp = time.time()
+        if self.recorder is not None:
+            self.recorder.frame(data, stamp, quality)
+        return data, stamp
+
+    def setDecode(self, gray: bool, reduction: int = 1) -> None:
+        """Choose how the next frames are decoded, e.g. BGR only while the HUD is shown
+
+        Args:
+            gray (bool): Decode to grayscale instead of BGR
+            reduction (int, optional): Decode at 1/reduction scale, one of 1, 2, 4 or 8. Defaults to 1.
+
+        Raises:
+            ValueError: unsupported reduction
+        """
+        self.decodeFlag = decodeFlag(gray, reduction)
+        self.gray = gray
+        self.reduction = reduction
+
+    def decode(self, data: bytes) -> cv2.typing.MatLike:
+        """Decode a JPEG received from the camera
+
+        Args:
+            data (bytes): JPEG data
 
-        # Read a frame from the video stream
-        img_resp = urllib.request.urlopen(self.url)
-        imgnp = np.array(bytearray(img_resp.read()), dtype=np.uint8)
-        cap.release()
+        Returns:
+            cv2.typing.MatLike: Decoded frame, BGR or grayscale depending on setDecode()
+        """
+        with METRICS.span("camera.decode"):
+            return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), self.decodeFlag)
+
+    def request(self) -> cv2.typing.MatLike:
+        # Read a frame through the shared keep-alive session
+        quality = self.quality
+        data, _ = self.fetch(quality)
+        self.frameQuality = quality
 
         # Decoding data
-        return cv2.imdecode(imgnp, -1)
-    
+        return self.decode(data)
+
+    def stream(self) -> _typing.Iterator[tuple[cv2.typing.MatLike, float]]:
+        """Yield frames from the MJPEG endpoint over one long-lived connection
+
+        Raises:
+            ConnectionError: the stream could not be opened or was cut
+
+        Yields:
+            tuple[cv2.typing.MatLike, float]: Frame and its reception time (time.time())
+        """
+        for img, stamp, _ in self._streamFrames(self.quality):
+            yield img, stamp
+
+    def _streamFrames(
+        self, quality: str, halt: threading.Event = None
+    ) -> _typing.Iterator[tuple[cv2.typing.MatLike, float, str]]:
+        url = streamUrlPicker(quality, self.host, self.streamPort)
+        parts = urlsplit(url)
+        conn = http.client.HTTPConnection(parts.netloc, timeout=self.session.timeout)
+        try:
+            conn.request("GET", parts.path or "/")
+            resp = conn.getresponse()
+            if resp.status != 200:
+                raise ConnectionError(f"HTTP {resp.status} from {url}")
+            parser = MjpegParser(boundaryOf(resp.getheader("Content-Type", "")))
+            # Ends cleanly when setQuality() asks for another stream or the capture stops
+            while quality == self.quality and not (halt is not None and halt.is_set()):
+                chunk = resp.read1(65536)
+                if not chunk:
+                    raise ConnectionError(f"Stream closed by {url}")
+                stamp = time.time()
+                for data in parser.feed(chunk):
+                    if self.recorder is not None:
+                        self.recorder.frame(data, stamp, quality)
+                    img = self.decode(data)
+                    if img is not None:
+                        yield img, stamp, quality
+        except ConnectionError:
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            raise ConnectionError(f"Failed to read the IP camera stream {url}") from e
+        finally:
+            conn.close()
+
+    def _stills(
+        self, halt: threading.Event
+    ) -> _typing.Iterator[tuple[cv2.typing.MatLike, float, str]]:
+        delay = self.session.backoff
+        attempt = 0
+        while not halt.is_set():
+            quality = self.quality
+            try:
+                data, stamp = self.fetch(quality, halt)
+            except ConnectionError:
+                if halt.is_set():
+                    return
+                # Every retry of the session failed, wait longer before the next round
+                attempt += 1
+                if attempt > self.session.retries:
+                    raise
+                if halt.wait(delay):
+                    return
+                delay = min(delay * 2, self.session.maxBackoff)
+                continue
+            attempt = 0
+            delay = self.session.backoff
+            img = self.decode(data)
+            if img is not None:
+                yield img, stamp, quality
+
+    def _reconnectingStream(
+        self, halt: threading.Event
+    ) -> _typing.Iterator[tuple[cv2.typing.MatLike, float, str]]:
+        delay = self.session.backoff
+        attempt = 0
+        while not halt.is_set():
+            try:
+                for frame in self._streamFrames(self.quality, halt):
+                    attempt = 0
+                    delay = self.session.backoff
+                    yield frame
+            except ConnectionError:
+                if halt.is_set():
+                    return
+                attempt += 1
+                if attempt > self.session.retries:
+                    raise
+                if halt.wait(delay):
+                    return
+                delay = min(delay * 2, self.session.maxBackoff)
+
+    def startCapture(self, streaming: bool = False) -> None:
+        """Prefetch frames in a background thread, keeping only the newest one
+
+        After latest() raised ConnectionError, calling it again reconnects.
+
+        Args:
+            streaming (bool, optional): Read the MJPEG stream instead of polling stills. Defaults to False.
+        """
+        if self._thread is not None:
+            return
+        # One event per capture, a thread left behind by stopCapture() keeps its own
+        self._halt = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(
+            target=self._captureLoop, args=(streaming, self._halt), daemon=True
+        )
+        self._thread.start()
+
+    def stopCapture(self, timeout: float = None) -> None:
+        """Stop the background capture thread
+
+        Retries and backoff waits end at once. A request in flight still
+        lasts up to the socket timeout: past the wait below, the thread is
+        left to end on its own.
+
+        Args:
+            timeout (float, optional): Max wait in seconds for the thread to end. Defaults to the session socket timeout.
+        """
+        self._halt.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(self.session.timeout if timeout is None else timeout)
+            self._thread = None
+
+    def _captureLoop(self, streaming: bool, halt: threading.Event) -> None:
+        frames = self._reconnectingStream(halt) if streaming else self._stills(halt)
+        try:
+            for img, stamp, quality in frames:
+                if halt.is_set():
+                    break
+                with self._cond:
+                    if self._seq > self._taken:
+                        # Nobody read the previous frame, it is overwritten
+                        self.dropped += 1
+                        METRICS.count("camera.dropped")
+                    self._frame = img
+                    self._stamp = stamp
+                    self._frameQuality = quality
+                    self._seq += 1
+                    self._cond.notify_all()
+        except ConnectionError as e:
+            with self._cond:
+                self._error = e
+                self._cond.notify_all()
+        finally:
+            frames.close()
+        with self._cond:
+            # startCapture() may start a new one, self._error stays until then
+            if self._thread is threading.current_thread():
+                self._thread = None
+
+    def latest(
+        self, timeout: float = None, newer: bool = True
+    ) -> tuple[cv2.typing.MatLike, float, str]:
+        """Return the newest prefetched frame, startCapture() must be called first
+
+        The quality it was captured at is returned with it: self.frameQuality
+        may already belong to a newer frame when another thread calls latest().
+
+        Args:
+            timeout (float, optional): Max wait in seconds. Defaults to None (forever).
+            newer (bool, optional): Wait for a frame not returned yet. False peeks without consuming it. Defaults to True.
+
+        Raises:
+            ConnectionError: the capture thread lost the camera
+            TimeoutError: no frame arrived in time
+
+        Returns:
+            tuple[cv2.typing.MatLike, float, str]: Frame, its capture timestamp (time.time()) and its quality
+        """
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: self._error is not None
+                or self._seq > (self._taken if newer else 0),
+                timeout,
+            )
+            if self._error is not None:
+                raise self._error
+            if not ready:
+                raise TimeoutError("No frame received from the IP camera")
+            if newer:
+                self._taken = self._seq
+            self.frameQuality = self._frameQuality
+            return self._frame, self._stamp, self._frameQuality
+
+    def command(self, url: URLTYPE, query: str = None) -> str:
+        """GET a firmware route of this camera
+
+        Args:
+            url (URLTYPE): Route to call, e.g. URLTYPE.URL_LIGHT_ON
+            query (str, optional): Query string, e.g. duty=128. Defaults to None.
+
+        Returns:
+            str: Firmware answer, e.g. LED ON
+        """
+        route = baseUrl(self.host) + url.value
+        if query:
+            route += "?" + query
+        return self.session.get(route).decode("utf8")
+
+    def setLight(self, duty: int) -> None:
+        """Set the PWM duty of the flash LED
+
+        Args:
+            duty (int): 0 (off) to 255 (full power)
+        """
+        if self.recorder is not None:
+            self.recorder.command("led", duty=duty)
+        self.command(URLTYPE.URL_LIGHT, f"duty={duty}")
+
     def TurnOnLight(self):
-        ret = urllib.request.urlopen(URLTYPE.URL_LIGHT_ON.value).read().decode("utf8")
+        if self.recorder is not None:
+            self.recorder.command("led", on=True)
+        ret = self.command(URLTYPE.URL_LIGHT_ON)
         # print(str(ret))
 
     def TurnOffLight(self):
-        ret = urllib.request.urlopen(URLTYPE.URL_LIGHT_OFF.value).read().decode("utf8")
+        if self.recorder is not None:
+            self.recorder.command("led", on=False)
+        ret = self.command(URLTYPE.URL_LIGHT_OFF)
         # print(str(ret))
 
     def TurnOnElectro(self):
-        ret = urllib.request.urlopen(URLTYPE.URL_ELECTRO_ON.value).read().decode("utf8")
+        if self.recorder is not None:
+            self.recorder.command("electro", on=True)
+        ret = self.command(URLTYPE.URL_ELECTRO_ON)
         # print(str(ret))
 
     def TurnOffElectro(self):
-        ret = urllib.request.urlopen(URLTYPE.URL_ELECTRO_OFF.value).read().decode("utf8")
+        if self.recorder is not None:
+            self.recorder.command("electro", on=False)
+        ret = self.command(URLTYPE.URL_ELECTRO_OFF)
         # print(str(ret))
 
+    def close(self) -> None:
+        """Stop capturing and release the camera connections"""
+        self.stopCapture()
+        self.session.close()
+
 
 def ShowRequest(img: cv2.typing.MatLike):
     cv2.imshow("live Cam Testing", img)
@@ -83,10 +660,13 @@ def ShowRequest(img: cv2.typing.MatLike):
 if __name__ == "__main__":
     key = None
     requester = WebRequester("mid")
+    streaming = len(sys.argv) > 1 and sys.argv[1] == "stream"
+    if streaming:
+        requester.startCapture(streaming=True)
 
     while True:
         try:
-            im = requester.request()
+            im = requester.latest()[0] if streaming else requester.request()
 
             if DEBUG_CV2:
                 ShowRequest(im)
@@ -94,8 +674,12 @@ if __name__ == "__main__":
                 if key == ord("q"):
                     break
 
+        except ConnectionError as e:
+            print(e)
+            break
         except KeyboardInterrupt:
             break
 
+    requester.close()
     if DEBUG_CV2:
         cv2.destroyAllWindows()